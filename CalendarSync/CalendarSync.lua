@@ -4,11 +4,20 @@
 --
 
 local _, ns = ...
+local JobScheduler = ns.JobScheduler
 
 local CalendarSync = LibStub("AceAddon-3.0"):NewAddon("Calendar Sync", "AceConsole-3.0", "AceTimer-3.0", "AceEvent-3.0", "AceHook-3.0")
 ns.CalendarSync = CalendarSync
 
 SYNC_DELAY = 5
+-- Bump when the layout of CalendarSyncExport changes, so older clients refuse to read it.
+local COMPACT_EXPORT_SCHEMA_VERSION = 1
+-- Journal entries kept per calendar before the oldest are dropped.
+local JOURNAL_MAX_ENTRIES = 1000
+-- Cached descriptions older than this many seconds are fetched again, as editing only the description doesn't change
+-- the event signature. At most DESCRIPTION_REFRESHES_PER_SYNC are refetched per sync, oldest first.
+local DESCRIPTION_MAX_AGE = 60 * 60
+local DESCRIPTION_REFRESHES_PER_SYNC = 5
 
 local dataDefaults = 
 {
@@ -17,6 +26,12 @@ local dataDefaults =
         debugMode = false,
 
         lookaheadDays = 30,
+        -- Save calendars to CalendarSyncExport as parallel arrays instead of AddonEvent tables.
+        compactExport = false,
+        -- Milliseconds per frame the sync may spend reading events before continuing on the next frame.
+        frameBudgetMs = 2,
+        -- Incremented for every journaled change to any calendar.
+        revision = 0,
         calendars = 
         {
             ---@class AddonEvent
@@ -27,7 +42,18 @@ local dataDefaults =
             ---@field startTime number  UTC timestamp.
             ---@field endTime number  UTC timestamp.
 
-            -- Guild/Club Name = { events = AddonEvent[] }
+            ---@class JournalEntry
+            ---@field revision number
+            ---@field eventID number
+            ---@field change string  "added", "changed" or "removed".
+
+            -- Guild/Club Name =
+            -- {
+            --     events = AddonEvent[],
+            --     descriptionSignatures = { [eventID] = signature },
+            --     descriptionTimes = { [eventID] = UTC timestamp of the sync the description was fetched in },
+            --     journal = { id = time the journal was started, truncatedRevision = revision of the last dropped entry, entries = JournalEntry[] }
+            -- }
         }
     }
 }
@@ -38,9 +64,7 @@ function CalendarSync:OnInitialize()
         if self.db.profile.calendars == nil then
             self.db.profile.calendars = {}
         end
-
-        -- Var reset.
-        self:StopEventDescriptionRequests()
+        self:ReadCompactExport()
 end
 
 function CalendarSync:OnEnable()
@@ -51,16 +75,18 @@ function CalendarSync:OnEnable()
     self:RegisterEvent("CALENDAR_UPDATE_GUILD_EVENTS", self.ScheduleCalendarSync, self)
     self:RegisterEvent("CALENDAR_OPEN_EVENT", self.OnEventOpened, self)
     self:RegisterEvent("CALENDAR_ACTION_PENDING", self.OnActionPending, self)
+    self:RegisterEvent("PLAYER_LOGOUT", self.OnLogout, self)
 
     CalendarFrame:HookScript("OnShow", function(_)
         CalendarSync:PrintDebugMessage("Calendar frame shown.")
         CalendarSync.calendarFrameShown = true
-        CalendarSync:CancelSync()
+        CalendarSync:PauseSync()
     end)
 
     CalendarFrame:HookScript("OnHide", function(_)
         CalendarSync:PrintDebugMessage("Calendar frame hidden.")
         CalendarSync.calendarFrameShown = false
+        CalendarSync:ResumeSync()
         self:ScheduleCalendarSync()
     end)
 
@@ -74,10 +100,23 @@ function CalendarSync:OnDisable()
     self:UnregisterEvent("CALENDAR_UPDATE_GUILD_EVENTS")
     self:UnregisterEvent("CALENDAR_OPEN_EVENT")
     self:UnregisterEvent("CALENDAR_ACTION_PENDING")
+    self:UnregisterEvent("PLAYER_LOGOUT")
 
+    if self.syncJob ~= nil then
+        self.requestedEvent = nil
+        self.syncJob:Cancel()
+    end
     CalendarFrame:UnhookAll()
 end
 
+function CalendarSync:OnLogout()
+    if self.db.profile.compactExport then
+        self:WriteCompactExport()
+    else
+        CalendarSyncExport = nil
+    end
+end
+
 function CalendarSync:CalendarSyncCommand()
     self.UI:Show()
 end
@@ -94,11 +133,39 @@ function CalendarSync:ScheduleCalendarSync()
     self.activeSyncTimer = self:ScheduleTimer(self.SyncCalendar, SYNC_DELAY, self)
 end
 
-function CalendarSync:CancelSync()
+-- Pause the sync in progress, so it doesn't open events while the player is browsing the calendar.
+function CalendarSync:PauseSync()
     if self.activeSyncTimer ~= nil then
         self:CancelTimer(self.activeSyncTimer)
     end
-    self:StopEventDescriptionRequests()
+    if self.syncJob ~= nil then
+        -- Events the player opens aren't the one requested.
+        self.requestedEvent = nil
+        self.syncJob:Pause()
+    end
+end
+
+function CalendarSync:ResumeSync()
+    if self.syncJob ~= nil then
+        self.syncJob:Resume()
+    end
+end
+
+-- Describe what the sync is doing for the options UI.
+function CalendarSync:GetSyncStatus()
+    local job = self.syncJob
+    if job == nil or not job:IsActive() then
+        return "Idle."
+    end
+    local status = job.state == "paused" and "Paused while the calendar is open" or "Syncing"
+    if job.stage == nil then
+        return status .. "."
+    end
+    return format("%s, %i of %i %s.", status, job.progress, job.total, job.stage)
+end
+
+function CalendarSync:OnSyncProgress()
+    LibStub("AceConfigRegistry-3.0"):NotifyChange("CalendarSync")
 end
 
 --region Utils
@@ -167,14 +234,128 @@ function CalendarSync:GetCalendarTimeBetween(startTime, endTime)
 end
 --endregion
 
+--region Compact export
+-- Write the calendars to CalendarSyncExport as parallel arrays, with titles and creators stored once in a string table.
+-- Events are moved out of the profile so they're only saved once, ReadCompactExport moves them back on load.
+function CalendarSync:WriteCompactExport()
+    local strings = {}
+    local stringIndexes = {}
+    -- Index into strings, or 0 for nil.
+    local function GetStringIndex(value)
+        if value == nil then
+            return 0
+        end
+        local index = stringIndexes[value]
+        if index == nil then
+            table.insert(strings, value)
+            index = #strings
+            stringIndexes[value] = index
+        end
+        return index
+    end
+
+    local calendars = {}
+    for calendarName, calendar in pairs(self.db.profile.calendars) do
+        local columns = {eventID = {}, title = {}, creator = {}, startTime = {}, endTime = {}, description = {}}
+        for index, event in ipairs(calendar.events or {}) do
+            columns.eventID[index] = event.eventID
+            columns.title[index] = GetStringIndex(event.title)
+            columns.creator[index] = GetStringIndex(event.creator)
+            columns.startTime[index] = event.startTime
+            columns.endTime[index] = event.endTime
+            columns.description[index] = event.description or ""
+        end
+        columns.journal = calendar.journal
+        calendars[calendarName] = columns
+        calendar.events = nil
+        calendar.journal = nil
+    end
+
+    CalendarSyncExport =
+    {
+        schemaVersion = COMPACT_EXPORT_SCHEMA_VERSION,
+        lookaheadDays = self.db.profile.lookaheadDays,
+        revision = self.db.profile.revision,
+        strings = strings,
+        calendars = calendars
+    }
+end
+
+function CalendarSync:ReadCompactExport()
+    if CalendarSyncExport == nil or CalendarSyncExport.schemaVersion ~= COMPACT_EXPORT_SCHEMA_VERSION then
+        return
+    end
+
+    local strings = CalendarSyncExport.strings
+    for calendarName, columns in pairs(CalendarSyncExport.calendars) do
+        if self.db.profile.calendars[calendarName] == nil then
+            self.db.profile.calendars[calendarName] = {}
+        end
+        local calendar = self.db.profile.calendars[calendarName]
+        -- Events are only missing from the profile when they were moved to the export.
+        if calendar.events == nil then
+            calendar.events = {}
+            for index, eventID in ipairs(columns.eventID) do
+                calendar.events[index] =
+                {
+                    eventID = eventID,
+                    title = strings[columns.title[index]],
+                    description = columns.description[index],
+                    creator = strings[columns.creator[index]],
+                    startTime = columns.startTime[index],
+                    endTime = columns.endTime[index]
+                }
+            end
+        end
+        if calendar.journal == nil then
+            calendar.journal = columns.journal
+        end
+    end
+end
+--endregion
+
+--region Change journal
+-- Record an added, changed or removed event under a new revision, so the client only has to sync the events journaled
+-- since the revision it last synced. The client can't tell the AddOn what it has synced, so the oldest entries are
+-- dropped once the journal is full, and the client syncs every event when entries it needs have been dropped.
+function CalendarSync:JournalChange(calendar, eventID, change)
+    if calendar.journal == nil then
+        calendar.journal = {id = time(), truncatedRevision = self.db.profile.revision, entries = {}}
+    end
+    self.db.profile.revision = self.db.profile.revision + 1
+    table.insert(calendar.journal.entries, {revision = self.db.profile.revision, eventID = eventID, change = change})
+    self:PrintDebugMessage(format("Journaled %s event %s at revision %i.", change, eventID, self.db.profile.revision))
+
+    while #calendar.journal.entries > JOURNAL_MAX_ENTRIES do
+        calendar.journal.truncatedRevision = table.remove(calendar.journal.entries, 1).revision
+    end
+end
+--endregion
+
 function CalendarSync:SyncCalendar()
     if not self:CanSync() then
         self:PrintDebugMessage("CanSync() returned false. Skipping calendar sync.")
         return
     end
+    if self.syncJob ~= nil and self.syncJob:IsActive() then
+        -- Let the sync in progress finish rather than starting over, then sync again to pick up any further changes.
+        self:PrintDebugMessage("Sync in progress. Syncing again once it's complete.")
+        self.syncPending = true
+        return
+    end
     self:PrintAddOnMessage("Running calendar sync")
-    self:StopEventDescriptionRequests()
+    self.syncPending = false
+
+    -- The sync is spread over as many frames as it needs, spending at most frameBudgetMs on each.
+    self.syncJob = JobScheduler:NewJob("Calendar sync",
+        function(job) self:RunCalendarSync(job) end,
+        function() return self.db.profile.frameBudgetMs end,
+        function() self:OnSyncProgress() end,
+        function() self:OnSyncFinished() end)
+    self.syncJob:Start()
+end
 
+function CalendarSync:RunCalendarSync(job)
     -- TODO: Sync all clubs. Option to disable certain ones in sync app or addon config.
     local guildName = C_Club.GetClubInfo(C_Club.GetGuildClubId()).name
     self.lastSyncCalendarTime = C_DateAndTime.GetCurrentCalendarTime()
@@ -184,10 +365,24 @@ function CalendarSync:SyncCalendar()
     if self.db.profile.calendars[guildName] == nil then
         self.db.profile.calendars[guildName] = {events = {}}
     end
-    self.lastSyncEvents = self.db.profile.calendars[guildName].events
-    self.db.profile.calendars[guildName].events = {}
+    local calendar = self.db.profile.calendars[guildName]
+    self.lastSyncEvents = calendar.events or {}
+
+    -- Event ID = signature of the event when its description was last requested.
+    local lastDescriptionSignatures = calendar.descriptionSignatures or {}
+    local descriptionSignatures = {}
+    local lastDescriptionTimes = calendar.descriptionTimes or {}
+    local descriptionTimes = {}
+    local staleDescriptions = {}
+    self.lastSyncEventsByID = {}
+    for _, event in ipairs(self.lastSyncEvents) do
+        self.lastSyncEventsByID[event.eventID] = event
+    end
+    local events = {}
+    local eventIDs = {}
+    local eventDescriptionRequests = {}
 
-    for _, event in ipairs(upcomingEvents) do
+    for index, event in ipairs(upcomingEvents) do
         local startTimestamp = CalendarSync:CalendarTimeToUTCTimestamp(event.startTime)
         local endTimestamp = CalendarSync:CalendarTimeToUTCTimestamp(event.endTime)
         self:PrintDebugMessage(format("Event: %s @ %i:%i - %i:%i", event.title, event.startTime.hour, event.startTime.minute, event.endTime.hour, event.endTime.minute))
@@ -206,43 +401,117 @@ function CalendarSync:SyncCalendar()
             startTime = startTimestamp,
             endTime = endTimestamp
         }
-        table.insert(self.db.profile.calendars[guildName].events, eventData)
-    end
+        table.insert(events, eventData)
+        eventIDs[eventData.eventID] = true
+
+        -- Only open events that are new or have changed since their description was last requested.
+        local signature = CalendarSync:GetEventSignature(eventData)
+        local lastSyncEvent = self.lastSyncEventsByID[eventData.eventID]
+        if lastSyncEvent ~= nil and lastDescriptionSignatures[eventData.eventID] == signature then
+            eventData.description = lastSyncEvent.description
+            descriptionSignatures[eventData.eventID] = signature
+            descriptionTimes[eventData.eventID] = lastDescriptionTimes[eventData.eventID] or 0
+            if self.lastSyncUTCTimestamp - descriptionTimes[eventData.eventID] >= DESCRIPTION_MAX_AGE then
+                table.insert(staleDescriptions, eventData)
+            end
+        else
+            table.insert(eventDescriptionRequests, eventData)
+        end
 
-    -- For whatever reason the description is left out and has to be requested individually, one request at a time.
-    self:RequestEventDescriptions(guildName)
-end
+        job:SetProgress("events read", index, #upcomingEvents)
+        job:Checkpoint()
+    end
 
--- Request Event for getting the description.
--- If index not supplied, will start at 1.
-function CalendarSync:RequestEventDescriptions(clubName, index)
-    self.currentEventRequestIndex = index or 1
-    self.currentEventRequestClubName = clubName
+    -- The events are only saved once they've all been read, so a logout part way through doesn't save a partial list.
+    calendar.events = events
+    calendar.descriptionSignatures = descriptionSignatures
+    calendar.descriptionTimes = descriptionTimes
+    for _, eventData in ipairs(events) do
+        local lastSyncEvent = self.lastSyncEventsByID[eventData.eventID]
+        if lastSyncEvent == nil then
+            self:JournalChange(calendar, eventData.eventID, "added")
+        elseif CalendarSync:GetEventSignature(lastSyncEvent) ~= CalendarSync:GetEventSignature(eventData) then
+            self:JournalChange(calendar, eventData.eventID, "changed")
+        end
+    end
+    -- Past events drop out of the list without being removed from the calendar.
+    for _, event in ipairs(self.lastSyncEvents) do
+        if not eventIDs[event.eventID] and event.startTime >= self.lastSyncUTCTimestamp then
+            self:JournalChange(calendar, event.eventID, "removed")
+        end
+    end
 
-    local event = self.db.profile.calendars[self.currentEventRequestClubName].events[self.currentEventRequestIndex]
-    if not event then
-        return
+    self:PrintDebugMessage(format("%i of %i event descriptions cached.", #events - #eventDescriptionRequests, #events))
+    -- Refresh a few of the oldest cached descriptions, so edits to only the description are picked up eventually.
+    table.sort(staleDescriptions, function(a, b) return descriptionTimes[a.eventID] < descriptionTimes[b.eventID] end)
+    local refreshCount = math.min(#staleDescriptions, DESCRIPTION_REFRESHES_PER_SYNC)
+    for index = 1, refreshCount do
+        table.insert(eventDescriptionRequests, staleDescriptions[index])
+    end
+    self:PrintDebugMessage(format("Refreshing %i of %i stale event descriptions.", refreshCount, #staleDescriptions))
+    -- For whatever reason the description is left out and has to be requested individually, one request at a time.
+    for index, eventData in ipairs(eventDescriptionRequests) do
+        job:SetProgress("descriptions fetched", index - 1, #eventDescriptionRequests)
+        self:RequestEventDescription(job, calendar, eventData)
     end
-    local eventIndexInfo = C_Calendar.GetEventIndexInfo(event.eventID)
-    self:PrintDebugMessage("Requesting " .. event.eventID .. " - " .. event.title)
+    job:SetProgress("descriptions fetched", #eventDescriptionRequests, #eventDescriptionRequests)
 
-    C_Calendar.OpenEvent(eventIndexInfo.offsetMonths, eventIndexInfo.monthDay, eventIndexInfo.eventIndex)
+    self:OnEventDescriptionsComplete(calendar)
 end
 
-function CalendarSync:StopEventDescriptionRequests()
-    self.currentEventRequestIndex = -1
-    self.currentEventRequestClubName = nil
+-- Signature of the fields that change when an event is edited, used to tell whether a cached description is still valid.
+function CalendarSync:GetEventSignature(event)
+    return format("%s|%i|%i|%s", event.title, event.startTime, event.endTime, event.creator or "")
+end
+
+-- Open an event to get its description, waiting until it has been closed again.
+function CalendarSync:RequestEventDescription(job, calendar, event)
+    while true do
+        local eventIndexInfo = C_Calendar.GetEventIndexInfo(event.eventID)
+        if eventIndexInfo == nil then
+            -- Removed while the sync was paused.
+            return
+        end
+        self:PrintDebugMessage("Requesting " .. event.eventID .. " - " .. event.title)
+
+        self.requestedEvent = event
+        self.requestedEventCalendar = calendar
+        self.requestedEventClosed = false
+        C_Calendar.OpenEvent(eventIndexInfo.offsetMonths, eventIndexInfo.monthDay, eventIndexInfo.eventIndex)
+        -- OnEventOpened reads the description and OnActionPending wakes the job once the event has been closed.
+        local wakeReason = nil
+        if not self.requestedEventClosed then
+            wakeReason = job:Wait()
+        end
+        self.requestedEvent = nil
+        self.requestedEventCalendar = nil
+        -- If the calendar was opened while waiting, the request may have been lost, so make it again.
+        if wakeReason ~= "resumed" then
+            return
+        end
+    end
 end
 
 function CalendarSync:OnEventOpened()
-    if self.currentEventRequestIndex < 1 then
+    if self.requestedEvent == nil then
         return
     end
 
     local selectedEvent = C_Calendar.GetEventInfo()
     if selectedEvent ~= nil then
         CalendarSync:PrintDebugMessage("Opened event: " .. selectedEvent.title)
-        self.db.profile.calendars[self.currentEventRequestClubName].events[self.currentEventRequestIndex].description = selectedEvent.description
+        local calendar = self.requestedEventCalendar
+        local event = self.requestedEvent
+        local signature = CalendarSync:GetEventSignature(event)
+        event.description = selectedEvent.description
+        calendar.descriptionSignatures[event.eventID] = signature
+        calendar.descriptionTimes[event.eventID] = self.lastSyncUTCTimestamp
+
+        -- New events and events with a new signature were journaled when the event list was read.
+        local lastSyncEvent = self.lastSyncEventsByID[event.eventID]
+        if lastSyncEvent ~= nil and lastSyncEvent.description ~= event.description and CalendarSync:GetEventSignature(lastSyncEvent) == signature then
+            self:JournalChange(calendar, event.eventID, "changed")
+        end
         CalendarSync:PrintDebugMessage("Got description: " .. selectedEvent.description)
     end
 
@@ -250,53 +519,42 @@ function CalendarSync:OnEventOpened()
 end
 
 function CalendarSync:OnActionPending(_, pending)
-    if not pending and not C_Calendar.IsEventOpen() and self.currentEventRequestIndex >= 1 then
-        if self.currentEventRequestIndex < #self.db.profile.calendars[self.currentEventRequestClubName].events then
-            self:RequestEventDescriptions(self.currentEventRequestClubName, self.currentEventRequestIndex + 1)
-        else
-            self:PrintAddOnMessage("Sync complete.")
-            -- Notify if event data has changed.
-            local dataChanged = false
-            for _, newEvent in ipairs(self.db.profile.calendars[self.currentEventRequestClubName].events) do
-                local isNewEvent = true
-                local hasNewDescription = false
-                for _, event in ipairs(self.lastSyncEvents) do
-                    if newEvent.eventID == event.eventID then
-                        isNewEvent = false
-                        if newEvent.description ~= event.description then
-                            hasNewDescription = true
-                            break
-                        end
-                    end
-                end
-                if isNewEvent or hasNewDescription then
-                    dataChanged = true
-                    self:PrintAddOnMessage("New events added or descriptions updated, /reload to save data for the client.")
-                    break
-                end
-            end
+    if not pending and not C_Calendar.IsEventOpen() and self.requestedEvent ~= nil then
+        self.requestedEventClosed = true
+        self.syncJob:Wake()
+    end
+end
 
-            -- Deleted events.
-            if not dataChanged then
-                for _, event in ipairs(self.lastSyncEvents) do
-                    if event.startTime >= self.lastSyncUTCTimestamp then
-                        local isDeleted = true
-                        for _, newEvent in ipairs(self.db.profile.calendars[self.currentEventRequestClubName].events) do
-                            if event.eventID == newEvent.eventID then
-                                isDeleted = false
-                                break
-                            end
-                        end
-                        if isDeleted then
-                            dataChanged = true
-                            self:PrintAddOnMessage("Existing event deleted, /reload to save data for the client.")
-                            break
-                        end
-                    end
-                end
-            end
+function CalendarSync:OnEventDescriptionsComplete(calendar)
+    self:PrintAddOnMessage("Sync complete.")
+    local events = calendar.events
+
+    -- Notify if event data has changed.
+    local dataChanged = false
+    local eventsByID = {}
+    for _, newEvent in ipairs(events) do
+        eventsByID[newEvent.eventID] = newEvent
+        local event = self.lastSyncEventsByID[newEvent.eventID]
+        if not dataChanged and (event == nil or newEvent.description ~= event.description) then
+            dataChanged = true
+            self:PrintAddOnMessage("New events added or descriptions updated, /reload to save data for the client.")
+        end
+    end
 
-            self:StopEventDescriptionRequests()
+    -- Deleted events.
+    if not dataChanged then
+        for _, event in ipairs(self.lastSyncEvents) do
+            if event.startTime >= self.lastSyncUTCTimestamp and eventsByID[event.eventID] == nil then
+                dataChanged = true
+                self:PrintAddOnMessage("Existing event deleted, /reload to save data for the client.")
+                break
+            end
         end
     end
-end
\ No newline at end of file
+end
+
+function CalendarSync:OnSyncFinished()
+    if self.syncPending then
+        self:ScheduleCalendarSync()
+    end
+end
@@ -52,6 +52,43 @@ local CALENDARSYNC_UI_CONFIG =
                     order = 1.12
                 },
 
+                toggleCompactExport =
+                {
+                    type = "toggle",
+                    name = "Compact Export",
+                    desc = "Save events in a smaller format that's faster for the client to read. Requires an up to date client.",
+                    width = "full",
+                    get = function() return CalendarSync.db.profile.compactExport end,
+                    set = function(info, val)
+                        CalendarSync.db.profile.compactExport = val
+                    end,
+                    order = 2.1
+                },
+
+                frameBudgetMs =
+                {
+                    type = "range",
+                    name = "Frame Budget (ms)",
+                    desc = "Milliseconds per frame the sync may spend reading events. Lower values avoid hitches but take longer to sync.",
+                    min = 0.5,
+                    max = 16,
+                    step = 0.5,
+                    get = function() return CalendarSync.db.profile.frameBudgetMs end,
+                    set = function(info, val)
+                        CalendarSync.db.profile.frameBudgetMs = val
+                    end,
+                    order = 3.1
+                },
+
+                syncStatus =
+                {
+                    type = "description",
+                    fontSize = "medium",
+                    name = function() return "Sync status: " .. CalendarSync:GetSyncStatus() end,
+                    width = "full",
+                    order = 3.2
+                },
+
                 toggleDebugMode =
                 {
                     type = "toggle",
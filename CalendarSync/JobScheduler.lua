@@ -0,0 +1,150 @@
+--
+-- Part of the CalendarSync AddOn
+-- Author: Aerthok - Defias Brotherhood EU
+--
+
+local _, ns = ...
+
+-- Runs long jobs as coroutines spread over as many frames as they need, so no frame spends more than the job's time
+-- budget on it. Jobs call Checkpoint() between units of work to give up the rest of the frame once the budget is spent,
+-- and Wait() to sleep until Wake() is called, such as when a requested calendar event has been opened.
+local JobScheduler = {}
+LibStub("AceTimer-3.0"):Embed(JobScheduler)
+ns.JobScheduler = JobScheduler
+
+-- AceTimer doesn't run timers more often than this, so running jobs step at most once a frame.
+local STEP_INTERVAL = 0.01
+
+---@class Job
+---@field name string
+---@field state string  "pending", "running", "waiting", "paused", "finished", "cancelled" or "failed".
+---@field stage string  What the job is counting progress of, nil until the job first sets its progress.
+---@field progress number
+---@field total number
+local Job = {}
+Job.__index = Job
+
+-- getFrameBudget returns the milliseconds the job may run for each frame.
+-- onProgress is called at most once a frame after the job's state or progress changes, onFinished once it completes.
+function JobScheduler:NewJob(name, func, getFrameBudget, onProgress, onFinished)
+    local job = setmetatable({}, Job)
+    job.name = name
+    job.state = "pending"
+    job.progress = 0
+    job.total = 0
+    job.coroutine = coroutine.create(func)
+    job.getFrameBudget = getFrameBudget
+    job.onProgress = onProgress
+    job.onFinished = onFinished
+    return job
+end
+
+function Job:Start()
+    if self.state == "pending" then
+        self:SetState("running")
+        self:Step()
+    end
+end
+
+function Job:IsActive()
+    return self.state == "pending" or self.state == "running" or self.state == "waiting" or self.state == "paused"
+end
+
+-- Stop stepping the job until Resume is called. A waiting job is woken with "resumed" when resumed, as whatever it was
+-- waiting for may have been missed.
+function Job:Pause()
+    if self.state == "running" or self.state == "waiting" then
+        self.pausedState = self.state
+        self:SetState("paused")
+        self:NotifyProgress()
+    end
+end
+
+function Job:Resume()
+    if self.state ~= "paused" then
+        return
+    end
+    self:SetState("running")
+    self:Step(self.pausedState == "waiting" and "resumed" or nil)
+end
+
+function Job:Cancel()
+    if self:IsActive() then
+        self:SetState("cancelled")
+        self:NotifyProgress()
+    end
+end
+
+-- Called from within the job.
+function Job:SetProgress(stage, progress, total)
+    self.stage = stage
+    self.progress = progress
+    self.total = total
+    self.progressChanged = true
+end
+
+-- Called from within the job between units of work, yielding until the next frame if this frame's budget is spent.
+function Job:Checkpoint()
+    if debugprofilestop() - self.stepStartTime >= self.getFrameBudget() then
+        coroutine.yield()
+    end
+end
+
+-- Called from within the job, yielding until Wake is called. Returns the arguments given to Wake.
+function Job:Wait()
+    self:SetState("waiting")
+    return coroutine.yield()
+end
+
+function Job:Wake(...)
+    if self.state == "waiting" then
+        self:SetState("running")
+        self:Step(...)
+    end
+end
+
+function Job:SetState(state)
+    self.state = state
+    self.progressChanged = true
+    if state == "running" then
+        if self.stepTimer == nil then
+            self.stepTimer = JobScheduler:ScheduleRepeatingTimer(function() self:Step() end, STEP_INTERVAL)
+        end
+    elseif self.stepTimer ~= nil then
+        JobScheduler:CancelTimer(self.stepTimer)
+        self.stepTimer = nil
+    end
+end
+
+function Job:Step(...)
+    if self.state ~= "running" then
+        return
+    end
+
+    self.stepStartTime = debugprofilestop()
+    local succeeded, err
+    if not self.started then
+        self.started = true
+        succeeded, err = coroutine.resume(self.coroutine, self, ...)
+    else
+        succeeded, err = coroutine.resume(self.coroutine, ...)
+    end
+    if not succeeded then
+        self:SetState("failed")
+        geterrorhandler()(err)
+    elseif coroutine.status(self.coroutine) == "dead" then
+        self:SetState("finished")
+    end
+
+    self:NotifyProgress()
+    if self.state == "finished" and self.onFinished ~= nil then
+        self.onFinished(self)
+    end
+end
+
+function Job:NotifyProgress()
+    if self.progressChanged and self.onProgress ~= nil then
+        self.progressChanged = false
+        self.onProgress(self)
+    end
+end
@@ -0,0 +1,133 @@
+"""Reader for the calendars saved by the AddOn.
+
+The AddOn either saves each event as an AddonEvent table inside its AceDB profile, or with Compact Export enabled,
+saves every calendar to CalendarSyncExport as parallel arrays with titles and creators stored once in a string table:
+
+CalendarSyncExport = {
+    ["schemaVersion"] = 1,
+    ["lookaheadDays"] = 30,
+    ["strings"] = {"Raid Night", "Player-Realm", ...},
+    ["calendars"] = {
+        ["Guild Name"] = {
+            ["eventID"] = {1111111, ...},
+            ["title"] = {1, ...},  -- Index into strings.
+            ["creator"] = {2, ...},  -- Index into strings, 0 if the event has no creator.
+            ["startTime"] = {1000000000, ...},
+            ["endTime"] = {1000000000, ...},
+            ["description"] = {"Event description", ...},
+            ["journal"] = {...},  -- Moved from the profile as is.
+        },
+    },
+    ["revision"] = 12,
+}
+
+The compact export is read when present, otherwise the profile is, so files saved with the option disabled, where
+CalendarSyncExport = nil, or by older versions of the AddOn can still be synced.
+
+Each calendar also has a journal of the events added, changed or removed at each revision, see AddonJournal.
+"""
+from typing import Any, List, Mapping, NamedTuple, Set
+
+from saved_variables import SavedVariablesError, decode_path
+from service_connectors import AddonEvent
+
+PROFILE_PATH = ("CalendarSyncDB", "profiles", "Default")
+COMPACT_EXPORT_PATH = ("CalendarSyncExport",)
+COMPACT_SCHEMA_VERSION = 1
+
+
+class JournalEntry(NamedTuple):
+    revision: int
+    event_id: str
+    # "added", "changed" or "removed".
+    change: str
+
+
+class AddonJournal(NamedTuple):
+    """The changes the AddOn made to a calendar, identified by a revision that increases with every change.
+    journal_id changes when the AddOn's saved data is reset, as revisions then start again."""
+    journal_id: int
+    # The AddOn drops the oldest entries once the journal is full, up to and including this revision.
+    truncated_revision: int
+    entries: List[JournalEntry]
+
+    def get_changed_event_ids(self, last_revision: int) -> Set[str] or None:
+        """Return the IDs of the events added, changed or removed after last_revision,
+        or None if entries after it have been dropped from the journal."""
+        if last_revision < self.truncated_revision:
+            return None
+        return {entry.event_id for entry in self.entries if entry.revision > last_revision}
+
+
+class AddonData(NamedTuple):
+    lookahead_days: int
+    # Calendar name: events.
+    calendars: Mapping[str, List[AddonEvent]]
+    # Revision of the most recent change to any calendar.
+    revision: int = 0
+    # Calendar name: journal, for calendars with a journal.
+    journals: Mapping[str, AddonJournal] = {}
+
+
+def read_addon_data(file_path: str) -> AddonData:
+    """Read the calendars from the AddOn's SavedVariables file."""
+    with open(file_path, "r", encoding="utf-8") as data_file:
+        return decode_addon_data(data_file.read())
+
+
+def decode_addon_data(text: str) -> AddonData:
+    try:
+        compact_export = decode_path(text, COMPACT_EXPORT_PATH)
+    except KeyError:
+        compact_export = None
+    # WoW saves CalendarSyncExport = nil while Compact Export is disabled.
+    if isinstance(compact_export, Mapping):
+        return decode_compact_export(compact_export)
+
+    addon_profile = decode_path(text, PROFILE_PATH)
+    addon_calendars = addon_profile.get("calendars") or {}
+    return AddonData(int(addon_profile["lookaheadDays"]),
+                     {calendar_name: addon_calendar_data.get("events") or []
+                      for calendar_name, addon_calendar_data in addon_calendars.items()},
+                     int(addon_profile.get("revision", 0)),
+                     _decode_journals(addon_calendars))
+
+
+def decode_compact_export(compact_export: Mapping[str, Any]) -> AddonData:
+    schema_version = compact_export.get("schemaVersion")
+    if schema_version != COMPACT_SCHEMA_VERSION:
+        raise SavedVariablesError("Unsupported compact export schema version {0}, please update the client.".format(schema_version))
+
+    # Empty Lua tables decode as dicts, so fall back to an empty list for every array.
+    strings = compact_export.get("strings") or []
+    calendars = {}
+    for calendar_name, columns in (compact_export.get("calendars") or {}).items():
+        events = []
+        for event_id, title, creator, start_time, end_time, description in zip(
+                columns.get("eventID") or [], columns.get("title") or [], columns.get("creator") or [],
+                columns.get("startTime") or [], columns.get("endTime") or [], columns.get("description") or []):
+            addon_event = {
+                "eventID": event_id,
+                "title": strings[title - 1],
+                "description": description,
+                "startTime": start_time,
+                "endTime": end_time,
+            }
+            if creator:
+                addon_event["creator"] = strings[creator - 1]
+            events.append(addon_event)
+        calendars[calendar_name] = events
+    return AddonData(int(compact_export["lookaheadDays"]), calendars, int(compact_export.get("revision", 0)),
+                     _decode_journals(compact_export.get("calendars") or {}))
+
+
+def _decode_journals(addon_calendars: Mapping[str, Mapping[str, Any]]) -> Mapping[str, AddonJournal]:
+    journals = {}
+    for calendar_name, addon_calendar_data in addon_calendars.items():
+        journal = addon_calendar_data.get("journal")
+        if not journal:
+            continue
+        entries = [JournalEntry(int(entry["revision"]), str(entry["eventID"]), entry["change"])
+                   for entry in journal.get("entries") or []]
+        journals[calendar_name] = AddonJournal(int(journal["id"]), int(journal.get("truncatedRevision", 0)), entries)
+    return journals
@@ -0,0 +1,172 @@
+import threading
+import time
+from collections import Counter
+from typing import Dict, Iterator, List, Mapping, Sequence, Set, Tuple
+
+from service_connectors import ServiceConnector, AddonEvent, CalendarID, ChangeOperation, EventComparisonResult, \
+    FailedChange, RemoteEvent, SYNCED_FIELDS
+
+DEFAULT_LATENCY = 0.05
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_PAGE_SIZE = 250
+
+
+class FakeConflictError(Exception):
+    """Raised when creating an event with an ID that's already in use."""
+    pass
+
+
+class FakeNotFoundError(Exception):
+    """Raised when changing an event that doesn't exist."""
+    pass
+
+
+class FakeServiceConnector(ServiceConnector):
+    """In memory calendar service for benchmarking syncs without a live account.
+
+    Behaves like the Google Calendar connector: event IDs are chosen by the client and stay in use once the event is
+    deleted, events are listed a page at a time and changes are sent in batches. Every request sleeps for Latency
+    seconds and is counted in request_counts.
+    """
+
+    thread_safe = True
+
+    def __init__(self, config):
+        super().__init__(__file__, config)
+        self.latency = float(self.get_optional_config_option("Latency", DEFAULT_LATENCY))
+        self.batch_size = int(self.get_optional_config_option("BatchSize", DEFAULT_BATCH_SIZE))
+        self.page_size = int(self.get_optional_config_option("PageSize", DEFAULT_PAGE_SIZE))
+        # Calendar name: calendar ID.
+        self.calendar_ids: Dict[str, CalendarID] = {}
+        # Calendar ID: {event ID: event}, including cancelled events.
+        self.calendars: Dict[CalendarID, Dict[str, RemoteEvent]] = {}
+        self.request_counts = Counter()
+        self.lock = threading.Lock()
+
+    def _request(self, request_name: str):
+        """Simulate sending a request to the service."""
+        with self.lock:
+            self.request_counts[request_name] += 1
+        self.call_with_retry(lambda: time.sleep(self.latency))
+
+    def get_calender_id_by_name(self, calendar_name: str) -> CalendarID:
+        self._request("calendar_list")
+        return self.calendar_ids.get(calendar_name)
+
+    def create_calendar(self, calendar_name: str) -> CalendarID:
+        self._request("calendar_insert")
+        with self.lock:
+            calendar_id = "calendar{0}".format(len(self.calendar_ids))
+            self.calendar_ids[calendar_name] = calendar_id
+            self.calendars[calendar_id] = {}
+        return calendar_id
+
+    def create_event(self, calendar_id: CalendarID, addon_event: AddonEvent):
+        self._request("event_insert")
+        self._create_event(calendar_id, addon_event)
+
+    def remove_event(self, calendar_id: CalendarID, remote_event: RemoteEvent):
+        self._request("event_delete")
+        self._remove_event(calendar_id, remote_event)
+
+    def update_event(self, calendar_id: CalendarID, remote_event: RemoteEvent, addon_event: AddonEvent):
+        self._request("event_patch")
+        self._update_event(calendar_id, remote_event, addon_event)
+
+    def apply_changes(self, calendar_id: CalendarID, creates: Sequence[AddonEvent],
+                      updates: Sequence[Tuple[RemoteEvent, AddonEvent]], deletes: Sequence[RemoteEvent]) -> List[FailedChange]:
+        changes = []
+        changes.extend((ChangeOperation.CREATE, addon_event, self._create_event, (addon_event,)) for addon_event in creates)
+        changes.extend((ChangeOperation.UPDATE, (remote_event, addon_event), self._update_event, (remote_event, addon_event))
+                       for remote_event, addon_event in updates)
+        changes.extend((ChangeOperation.DELETE, remote_event, self._remove_event, (remote_event,)) for remote_event in deletes)
+
+        failed_changes = []
+        for chunk_start in range(0, len(changes), self.batch_size):
+            self._request("batch")
+            for operation, event, apply_change, args in changes[chunk_start:chunk_start + self.batch_size]:
+                try:
+                    apply_change(calendar_id, *args)
+                except (FakeConflictError, FakeNotFoundError) as e:
+                    failed_changes.append(FailedChange(operation, event, e))
+        return failed_changes
+
+    def _create_event(self, calendar_id: CalendarID, addon_event: AddonEvent):
+        with self.lock:
+            events = self.calendars[calendar_id]
+            if addon_event["eventID"] in events:
+                raise FakeConflictError(addon_event["eventID"])
+            events[addon_event["eventID"]] = {
+                "id": addon_event["eventID"],
+                "status": "confirmed",
+                "title": addon_event["title"],
+                "description": addon_event["description"],
+                "creator": addon_event["creator"],
+                "startTime": addon_event["startTime"],
+                "endTime": addon_event["endTime"],
+            }
+
+    def _remove_event(self, calendar_id: CalendarID, remote_event: RemoteEvent):
+        with self.lock:
+            event = self.calendars[calendar_id].get(remote_event["id"])
+            if event is None or event["status"] == "cancelled":
+                raise FakeNotFoundError(remote_event["id"])
+            event["status"] = "cancelled"
+
+    def _update_event(self, calendar_id: CalendarID, remote_event: RemoteEvent, addon_event: AddonEvent):
+        with self.lock:
+            event = self.calendars[calendar_id].get(remote_event["id"])
+            if event is None:
+                raise FakeNotFoundError(remote_event["id"])
+            for field in self.get_changed_fields(addon_event, event):
+                event[field] = addon_event[field]
+
+    def is_change_already_applied(self, operation: ChangeOperation, error: Exception) -> bool:
+        return (operation is ChangeOperation.CREATE and isinstance(error, FakeConflictError)) or \
+               (operation is ChangeOperation.DELETE and isinstance(error, FakeNotFoundError))
+
+    def get_request_count(self, change_count: int) -> int:
+        return -(-change_count // self.batch_size)
+
+    def get_event(self, calendar_id: CalendarID, addon_event: AddonEvent) -> RemoteEvent or None:
+        self._request("event_get")
+        event = self.calendars[calendar_id].get(addon_event["eventID"])
+        return dict(event) if event is not None else None
+
+    def get_existing_events(self, calendar_id: CalendarID) -> Mapping[str, RemoteEvent]:
+        return {key: dict(event) for key, event in self._iter_events(calendar_id)}
+
+    def get_events(self, calendar_id: CalendarID, lookahead_days: int) -> Iterator[RemoteEvent]:
+        # Like Google Calendar, every upcoming event is returned as the addon decides what's in the lookahead window.
+        now = time.time()
+        for _, event in self._iter_events(calendar_id):
+            if event["status"] != "cancelled" and event["endTime"] > now:
+                yield dict(event)
+
+    def _iter_events(self, calendar_id: CalendarID) -> Iterator[Tuple[str, RemoteEvent]]:
+        with self.lock:
+            events = list(self.calendars[calendar_id].items())
+        # An empty calendar still takes a request to list.
+        for page_start in range(0, max(len(events), 1), self.page_size):
+            self._request("event_list")
+            yield from events[page_start:page_start + self.page_size]
+
+    def get_remote_event_key(self, remote_event: RemoteEvent) -> str:
+        return remote_event["id"].strip()
+
+    def compare_events(self, addon_event: AddonEvent, remote_event: RemoteEvent) -> EventComparisonResult:
+        if addon_event["eventID"].strip() != remote_event["id"].strip():
+            return EventComparisonResult.DIFFERENT
+        if self.get_changed_fields(addon_event, remote_event):
+            return EventComparisonResult.UPDATED
+        return EventComparisonResult.EQUAL
+
+    def get_changed_fields(self, addon_event: AddonEvent, remote_event: RemoteEvent) -> Set[str]:
+        return {field for field in SYNCED_FIELDS if addon_event[field] != remote_event[field]}
+
+    def event_tostring(self, remote_event: RemoteEvent) -> str:
+        return "{0} - {1}".format(remote_event["title"], remote_event["startTime"])
+
+
+def get_connector(config) -> ServiceConnector:
+    return FakeServiceConnector(config)
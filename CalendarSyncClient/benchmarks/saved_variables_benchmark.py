@@ -0,0 +1,76 @@
+"""Compare the SavedVariables parser against slpp on generated files of increasing size,
+along with reading the same calendars from the AddOn's compact export.
+
+Run from the CalendarSyncClient folder with:
+    python -m benchmarks.saved_variables_benchmark
+The slpp comparison is skipped if slpp isn't installed, pip install slpp to include it.
+"""
+import argparse
+import importlib.util
+import time
+
+import saved_variables
+from addon_data import decode_addon_data
+from benchmarks.saved_variables_data import generate_compact_saved_variables, generate_events, generate_saved_variables
+
+PROFILE_PATH = ("CalendarSyncDB", "profiles", "Default")
+
+
+def decode_with_slpp(text: str):
+    """The previous whole-file decode used by the client."""
+    from slpp import slpp as lua
+
+    if text[0] != "{":
+        text = "{" + text + "}"
+    return lua.decode(text.replace("\\n", "\n"))["CalendarSyncDB"]["profiles"]["Default"]
+
+
+def time_call(function, repeats: int) -> float:
+    """Return the fastest time of repeats calls to function."""
+    best_time = None
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        function()
+        elapsed_time = time.perf_counter() - start_time
+        if best_time is None or elapsed_time < best_time:
+            best_time = elapsed_time
+    return best_time
+
+
+def run(event_counts, guild_count: int, padding_profiles: int, repeats: int):
+    compare_slpp = importlib.util.find_spec("slpp") is not None
+    if not compare_slpp:
+        print("slpp isn't installed, pip install slpp to compare the parser against it.")
+
+    print("{0:>8} {1:>10} {2:>10} {3:>12} {4:>8} {5:>13} {6:>12}".format(
+        "events", "size (KB)", "slpp (s)", "parser (s)", "speedup", "compact (KB)", "compact (s)"))
+    for event_count in event_counts:
+        calendars = {"Guild {0}".format(guild): generate_events(event_count, 1600000000, seed=guild)
+                     for guild in range(guild_count)}
+        text = generate_saved_variables(calendars, padding_profiles=padding_profiles, padding_characters=event_count)
+
+        if compare_slpp and saved_variables.decode_path(text, PROFILE_PATH) != decode_with_slpp(text):
+            raise AssertionError("Parser output doesn't match slpp for {0} events".format(event_count))
+        compact_text = generate_compact_saved_variables(calendars, padding_characters=event_count)
+        if decode_addon_data(compact_text) != decode_addon_data(text):
+            raise AssertionError("Compact export doesn't match the profile for {0} events".format(event_count))
+
+        slpp_time = time_call(lambda: decode_with_slpp(text), repeats) if compare_slpp else None
+        parser_time = time_call(lambda: saved_variables.decode_path(text, PROFILE_PATH), repeats)
+        compact_time = time_call(lambda: decode_addon_data(compact_text), repeats)
+        print("{0:>8} {1:>10.0f} {2:>10} {3:>12.4f} {4:>8} {5:>13.0f} {6:>12.4f}".format(
+            event_count, len(text) / 1024, "{0:.4f}".format(slpp_time) if slpp_time is not None else "-", parser_time,
+            "{0:.1f}x".format(slpp_time / parser_time) if slpp_time is not None else "-",
+            len(compact_text) / 1024, compact_time))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, nargs="+", default=[10, 100, 1000, 5000],
+                        help="Events per calendar for each generated file.")
+    parser.add_argument("--guilds", type=int, default=2, help="Calendars per generated file.")
+    parser.add_argument("--padding-profiles", type=int, default=2,
+                        help="Unused profiles holding a copy of the calendars, which the parser skips.")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per measurement, the fastest is reported.")
+    args = parser.parse_args()
+    run(args.events, args.guilds, args.padding_profiles, args.repeats)
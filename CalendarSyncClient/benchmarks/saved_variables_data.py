@@ -0,0 +1,187 @@
+import random
+from typing import List, Mapping, Tuple
+
+EVENT_DURATION = 2 * 60 * 60
+# Journal entries the AddOn keeps per calendar before dropping the oldest.
+JOURNAL_MAX_ENTRIES = 1000
+
+
+def generate_events(event_count: int, start_time: int, seed: int = 0, first_event_id: int = 1000000) -> List[Mapping]:
+    """Return event_count AddonEvent dicts spread over the days following start_time."""
+    rng = random.Random(seed)
+    events = []
+    for index in range(event_count):
+        event_start = start_time + rng.randrange(0, 150 * 24 * 60 * 60, 15 * 60)
+        events.append({
+            "eventID": first_event_id + index,
+            "title": "Raid Night {0}".format(index),
+            "description": "Bring flasks and food.\nInvites at 19:45, pulling at {0}.".format(rng.randrange(1, 100)),
+            "creator": "Player{0}-Realm".format(rng.randrange(0, 200)),
+            "startTime": event_start,
+            "endTime": event_start + EVENT_DURATION,
+        })
+    return events
+
+
+def _lua_string(value: str) -> str:
+    return "\"" + value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") + "\""
+
+
+def _lua_value(value, indent: str) -> str:
+    """Return a string, number, list or dict as a Lua value, with tables indented the way WoW writes them."""
+    if isinstance(value, str):
+        return _lua_string(value)
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return str(value)
+    lines = ["{"]
+    if isinstance(value, Mapping):
+        for key, item in value.items():
+            lua_key = _lua_string(key) if isinstance(key, str) else str(key)
+            lines.append("{0}\t[{1}] = {2},".format(indent, lua_key, _lua_value(item, indent + "\t")))
+    else:
+        for index, item in enumerate(value, 1):
+            lines.append("{0}\t{1}, -- [{2}]".format(indent, _lua_value(item, indent + "\t"), index))
+    lines.append(indent + "}")
+    return "\n".join(lines)
+
+
+def add_journal_entries(journal: Mapping or None, revision: int, old_events: List[Mapping],
+                        new_events: List[Mapping]) -> Tuple[Mapping, int]:
+    """Journal the differences between two versions of a calendar the way the AddOn does.
+    Return the journal, created if None, and the new revision."""
+    if journal is None:
+        journal = {"id": 1600000000, "truncatedRevision": revision, "entries": []}
+    old_events_by_id = {event["eventID"]: event for event in old_events}
+    new_event_ids = set()
+    for event in new_events:
+        new_event_ids.add(event["eventID"])
+        old_event = old_events_by_id.get(event["eventID"])
+        if old_event != event:
+            revision += 1
+            journal["entries"].append({"revision": revision, "eventID": event["eventID"],
+                                       "change": "added" if old_event is None else "changed"})
+    for event in old_events:
+        if event["eventID"] not in new_event_ids:
+            revision += 1
+            journal["entries"].append({"revision": revision, "eventID": event["eventID"], "change": "removed"})
+    if len(journal["entries"]) > JOURNAL_MAX_ENTRIES:
+        journal["truncatedRevision"] = journal["entries"][-JOURNAL_MAX_ENTRIES - 1]["revision"]
+        del journal["entries"][:-JOURNAL_MAX_ENTRIES]
+    return journal, revision
+
+
+def _lua_event(event: Mapping, indent: str) -> str:
+    lines = [indent + "{"]
+    for key, value in event.items():
+        lua_value = _lua_string(value) if isinstance(value, str) else str(value)
+        lines.append("{0}\t[\"{1}\"] = {2},".format(indent, key, lua_value))
+    return "\n".join(lines)
+
+
+def generate_saved_variables(calendars: Mapping[str, List[Mapping]], lookahead_days: int = 150,
+                             padding_profiles: int = 0, padding_characters: int = 0,
+                             journals: Mapping[str, Mapping] = None, revision: int = 0, nil_export: bool = True) -> str:
+    """Return the text of a CalendarSync.lua SavedVariables file in the format WoW writes.
+    calendars maps guild names to lists of AddonEvent dicts and journals maps them to journals from add_journal_entries.
+    padding_profiles adds unused profiles holding a copy of the calendars and padding_characters adds profileKeys
+    entries, to simulate accounts with many characters.
+    nil_export writes the CalendarSyncExport = nil WoW saves while Compact Export is disabled, without it the file
+    matches one saved by an AddOn version from before the option.
+    """
+    lines = ["", "CalendarSyncDB = {", "\t[\"profileKeys\"] = {"]
+    for index in range(padding_characters):
+        lines.append("\t\t[\"Character{0} - Realm\"] = \"Default\",".format(index))
+    lines.append("\t},")
+    lines.append("\t[\"profiles\"] = {")
+
+    profile_names = ["Character{0} - Realm".format(index) for index in range(padding_profiles)] + ["Default"]
+    for profile_name in profile_names:
+        lines.append("\t\t[{0}] = {{".format(_lua_string(profile_name)))
+        lines.append("\t\t\t[\"calendars\"] = {")
+        for calendar_name, events in calendars.items():
+            lines.append("\t\t\t\t[{0}] = {{".format(_lua_string(calendar_name)))
+            lines.append("\t\t\t\t\t[\"events\"] = {")
+            for index, event in enumerate(events, 1):
+                lines.append(_lua_event(event, "\t\t\t\t\t\t"))
+                lines.append("\t\t\t\t\t\t}}, -- [{0}]".format(index))
+            lines.append("\t\t\t\t\t},")
+            if journals and calendar_name in journals:
+                lines.append("\t\t\t\t\t[\"journal\"] = {0},".format(_lua_value(journals[calendar_name], "\t\t\t\t\t")))
+            lines.append("\t\t\t\t},")
+        lines.append("\t\t\t},")
+        lines.append("\t\t\t[\"lookaheadDays\"] = {0},".format(lookahead_days))
+        if revision:
+            lines.append("\t\t\t[\"revision\"] = {0},".format(revision))
+        lines.append("\t\t},")
+
+    lines.append("\t},")
+    lines.append("}")
+    if nil_export:
+        lines.append("CalendarSyncExport = nil")
+    lines.append("")
+    return "\n".join(lines)
+
+
+def generate_compact_saved_variables(calendars: Mapping[str, List[Mapping]], lookahead_days: int = 150,
+                                     padding_characters: int = 0, journals: Mapping[str, Mapping] = None,
+                                     revision: int = 0) -> str:
+    """Return the text of a CalendarSync.lua SavedVariables file written with the AddOn's Compact Export enabled."""
+    lines = ["", "CalendarSyncDB = {", "\t[\"profileKeys\"] = {"]
+    for index in range(padding_characters):
+        lines.append("\t\t[\"Character{0} - Realm\"] = \"Default\",".format(index))
+    lines.append("\t},")
+    lines.append("\t[\"profiles\"] = {")
+    lines.append("\t\t[\"Default\"] = {")
+    lines.append("\t\t\t[\"calendars\"] = {")
+    for calendar_name in calendars:
+        lines.append("\t\t\t\t[{0}] = {{".format(_lua_string(calendar_name)))
+        lines.append("\t\t\t\t},")
+    lines.append("\t\t\t},")
+    lines.append("\t\t\t[\"compactExport\"] = true,")
+    lines.append("\t\t\t[\"lookaheadDays\"] = {0},".format(lookahead_days))
+    if revision:
+        lines.append("\t\t\t[\"revision\"] = {0},".format(revision))
+    lines.append("\t\t},")
+    lines.append("\t},")
+    lines.append("}")
+
+    strings = {}
+    columns_by_calendar = {}
+    for calendar_name, events in calendars.items():
+        columns = {"eventID": [], "title": [], "creator": [], "startTime": [], "endTime": [], "description": []}
+        for event in events:
+            columns["eventID"].append(str(event["eventID"]))
+            columns["title"].append(str(strings.setdefault(event["title"], len(strings) + 1)))
+            creator = event.get("creator")
+            columns["creator"].append(str(strings.setdefault(creator, len(strings) + 1)) if creator is not None else "0")
+            columns["startTime"].append(str(event["startTime"]))
+            columns["endTime"].append(str(event["endTime"]))
+            columns["description"].append(_lua_string(event["description"]))
+        columns_by_calendar[calendar_name] = columns
+
+    lines.append("CalendarSyncExport = {")
+    lines.append("\t[\"schemaVersion\"] = 1,")
+    lines.append("\t[\"strings\"] = {")
+    for index, value in enumerate(strings, 1):
+        lines.append("\t\t{0}, -- [{1}]".format(_lua_string(value), index))
+    lines.append("\t},")
+    lines.append("\t[\"calendars\"] = {")
+    for calendar_name, columns in columns_by_calendar.items():
+        lines.append("\t\t[{0}] = {{".format(_lua_string(calendar_name)))
+        for column_name, values in columns.items():
+            lines.append("\t\t\t[\"{0}\"] = {{".format(column_name))
+            for index, value in enumerate(values, 1):
+                lines.append("\t\t\t\t{0}, -- [{1}]".format(value, index))
+            lines.append("\t\t\t},")
+        if journals and calendar_name in journals:
+            lines.append("\t\t\t[\"journal\"] = {0},".format(_lua_value(journals[calendar_name], "\t\t\t")))
+        lines.append("\t\t},")
+    lines.append("\t},")
+    lines.append("\t[\"lookaheadDays\"] = {0},".format(lookahead_days))
+    if revision:
+        lines.append("\t[\"revision\"] = {0},".format(revision))
+    lines.append("}")
+    lines.append("")
+    return "\n".join(lines)
@@ -0,0 +1,176 @@
+"""Benchmark full syncs of generated SavedVariables files against an in memory fake calendar service.
+
+Runs these scenarios in order against the same fake service:
+    cold      Every calendar and event is new.
+    no-op     The file is rewritten without changes, as WoW does on every logout.
+    churn     10% of events change, half of them edited and half replaced by new events.
+    delete    Every event is removed from the in-game calendars.
+
+Run from the CalendarSyncClient folder with:
+    python -m benchmarks.sync_benchmark
+Use --service ics_file to sync to .ics files instead, reporting file writes and bytes written in place of requests.
+Scenarios run in a temporary folder, so options.ini and the data folder are left untouched.
+Memory tracing slows down Python heavy code, use --no-trace-memory for more representative wall times.
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List, Mapping
+
+from benchmarks.fake_service import FakeServiceConnector
+from benchmarks.saved_variables_data import EVENT_DURATION, add_journal_entries, generate_compact_saved_variables, \
+    generate_events, generate_saved_variables
+from instrumentation import get_counter_deltas
+from service_connectors import ServiceConnector, register_connector
+from sync_client import SyncClient
+
+FAKE_SERVICE_NAME = "fake_service"
+CHURN_FRACTION = 0.1
+
+# The fake service lives outside the service_connectors package.
+register_connector(FAKE_SERVICE_NAME, "benchmarks.fake_service")
+
+
+def write_options(path: str, service_name: str, save_file_path: str, latency: float, max_concurrent_syncs: int):
+    with open(path, "w", encoding="utf-8") as options_file:
+        options_file.write("[Services]\nEnabledServices={0}\nMaxConcurrentSyncs={1}\n\n".format(
+            service_name, max_concurrent_syncs))
+        options_file.write("[AddOn]\nSaveFilePath={0}\n\n".format(save_file_path))
+        options_file.write("[{0}]\nLatency={1}\nOutputFolder=calendars\n".format(service_name, latency))
+
+
+class SavedVariablesWriter(object):
+    """Writes each version of the calendars to a SavedVariables file, journaling the changes between them."""
+
+    def __init__(self, path: str, compact: bool, journal: bool):
+        self.path = path
+        self.compact = compact
+        self.journal = journal
+        self.journals = {}
+        self.revision = 0
+        self.calendars = {}
+
+    def write(self, calendars: Mapping[str, List[Mapping]]):
+        if self.journal:
+            for calendar_name, events in calendars.items():
+                self.journals[calendar_name], self.revision = add_journal_entries(
+                    self.journals.get(calendar_name), self.revision, self.calendars.get(calendar_name, []), events)
+        self.calendars = calendars
+        generate = generate_compact_saved_variables if self.compact else generate_saved_variables
+        with open(self.path, "w", encoding="utf-8") as saved_variables_file:
+            saved_variables_file.write(generate(calendars, journals=self.journals, revision=self.revision))
+
+
+def churn_events(events: List[Dict], rng: random.Random, next_event_id: int) -> List[Dict]:
+    """Return a copy of events with CHURN_FRACTION of them changed, half edited and half replaced by new events."""
+    events = [dict(event) for event in events]
+    churned_indexes = rng.sample(range(len(events)), int(len(events) * CHURN_FRACTION))
+    half = len(churned_indexes) // 2
+    for index in churned_indexes[:half]:
+        events[index]["title"] += " (rescheduled)"
+        events[index]["startTime"] += 30 * 60
+        events[index]["endTime"] = events[index]["startTime"] + EVENT_DURATION
+    new_events = generate_events(len(churned_indexes) - half, events[0]["startTime"], seed=rng.random(),
+                                 first_event_id=next_event_id)
+    for index, new_event in zip(churned_indexes[half:], new_events):
+        events[index] = new_event
+    return events
+
+
+def get_request_counts(service: ServiceConnector) -> Mapping[str, int]:
+    """Return the fake service's requests by type, or for other services, what they report of their transport."""
+    if isinstance(service, FakeServiceConnector):
+        return dict(service.request_counts)
+    return dict(service.get_transport_stats() or {})
+
+
+def run_scenario(name: str, sync_client: SyncClient, service: ServiceConnector, save_file_path: str,
+                 trace_memory: bool, verbose: bool):
+    request_counts = get_request_counts(service)
+    request_stats = service.get_request_stats()
+    if trace_memory:
+        tracemalloc.start()
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    start_time = time.perf_counter()
+    with output:
+        sync_client._sync_calendar(save_file_path)
+    elapsed_time = time.perf_counter() - start_time
+    peak_memory = None
+    if trace_memory:
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    request_counts = get_counter_deltas(request_counts, get_request_counts(service))
+    request_summary = ", ".join("{0} {1}".format(count, request_name)
+                                for request_name, count in sorted(request_counts.items()) if count)
+    print("{0:<8} {1:>9.3f} {2:>9} {3:>10} {4}".format(
+        name, elapsed_time, get_counter_deltas(request_stats, service.get_request_stats())["requests"],
+        "{0:.1f}".format(peak_memory / 1024 / 1024) if peak_memory is not None else "-", request_summary))
+
+
+def run(event_count: int, guild_count: int, latency: float, max_concurrent_syncs: int, seed: int,
+        trace_memory: bool, verbose: bool, compact: bool, journal: bool, service_name: str = FAKE_SERVICE_NAME):
+    rng = random.Random(seed)
+    start_time = int(time.time()) + 60 * 60
+    calendars = {"Guild {0}".format(guild): generate_events(event_count, start_time, seed=guild,
+                                                            first_event_id=(guild + 1) * 1000000)
+                 for guild in range(guild_count)}
+    next_event_id = (guild_count + 1) * 1000000
+
+    if service_name == FAKE_SERVICE_NAME:
+        print("{0} calendars of {1} events, {2}s latency per request".format(guild_count, event_count, latency))
+    else:
+        print("{0} calendars of {1} events synced to {2}".format(guild_count, event_count, service_name))
+    print("{0:<8} {1:>9} {2:>9} {3:>10} {4}".format("scenario", "wall (s)", "requests", "peak (MB)", "by type"))
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as benchmark_directory:
+        os.chdir(benchmark_directory)
+        try:
+            save_file_path = os.path.join(benchmark_directory, "CalendarSync.lua")
+            write_options("options.ini", service_name, save_file_path, latency, max_concurrent_syncs)
+            saved_variables_writer = SavedVariablesWriter(save_file_path, compact, journal)
+            saved_variables_writer.write(calendars)
+            sync_client = SyncClient(config_path="options.ini")
+            service = sync_client.service_connectors[0].get_connector()
+
+            run_scenario("cold", sync_client, service, save_file_path, trace_memory, verbose)
+
+            saved_variables_writer.write(calendars)
+            run_scenario("no-op", sync_client, service, save_file_path, trace_memory, verbose)
+
+            calendars = dict(calendars)
+            for calendar_name, events in calendars.items():
+                calendars[calendar_name] = churn_events(events, rng, next_event_id)
+                next_event_id += event_count
+            saved_variables_writer.write(calendars)
+            run_scenario("churn", sync_client, service, save_file_path, trace_memory, verbose)
+
+            saved_variables_writer.write({calendar_name: [] for calendar_name in calendars})
+            run_scenario("delete", sync_client, service, save_file_path, trace_memory, verbose)
+
+            sync_client.state_store.close()
+        finally:
+            os.chdir(working_directory)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=1000, help="Events per calendar.")
+    parser.add_argument("--guilds", type=int, default=2, help="Number of calendars.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds the fake service takes per request.")
+    parser.add_argument("--max-concurrent-syncs", type=int, default=4, help="MaxConcurrentSyncs for the client.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for choosing which events change.")
+    parser.add_argument("--no-trace-memory", action="store_true", help="Skip measuring peak memory.")
+    parser.add_argument("--verbose", action="store_true", help="Show the client's sync output.")
+    parser.add_argument("--compact", action="store_true", help="Write files in the AddOn's compact export format.")
+    parser.add_argument("--no-journal", action="store_true", help="Leave out the AddOn's change journal.")
+    parser.add_argument("--service", choices=[FAKE_SERVICE_NAME, "ics_file"], default=FAKE_SERVICE_NAME,
+                        help="Service to sync to. Latency only applies to the fake service.")
+    args = parser.parse_args()
+    run(args.events, args.guilds, args.latency, args.max_concurrent_syncs, args.seed,
+        not args.no_trace_memory, args.verbose, args.compact, not args.no_journal, args.service)
@@ -0,0 +1,120 @@
+import json
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Mapping, TypeVar
+
+T = TypeVar("T")
+
+
+class SyncMetrics(object):
+    """Thread safe collection of phase durations and counters for a single sync.
+
+    Durations are summed per phase, so phases run for several calendars at once can add up to more than the wall time
+    of the sync. Phases can be nested, time spent in a nested phase only counts towards the nested phase.
+    """
+
+    def __init__(self):
+        self.start_time = time.time()
+        self._start_counter = time.perf_counter()
+        self.wall_time = None
+        self.durations = defaultdict(float)
+        self.counters = Counter()
+        self._lock = threading.Lock()
+        # Time spent in nested phases for each phase running on the current thread, innermost last.
+        self._local = threading.local()
+
+    @contextmanager
+    def time_phase(self, phase: str):
+        """Add the time spent in the block, less any nested phases, to the duration of phase."""
+        nested_times = getattr(self._local, "nested_times", None)
+        if nested_times is None:
+            nested_times = self._local.nested_times = []
+        nested_times.append(0.0)
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_time = time.perf_counter() - start_time
+            self.add_duration(phase, elapsed_time - nested_times.pop())
+            if nested_times:
+                nested_times[-1] += elapsed_time
+
+    def time_iterator(self, phase: str, iterator: Iterable[T]) -> Iterator[T]:
+        """Yield from iterator, adding only the time spent fetching each item to the duration of phase.
+        Used for lazy iterators where the work happens as they're consumed."""
+        iterator = iter(iterator)
+        while True:
+            with self.time_phase(phase):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def add_duration(self, phase: str, seconds: float):
+        with self._lock:
+            self.durations[phase] += seconds
+
+    def increment(self, counter: str, value: int = 1):
+        with self._lock:
+            self.counters[counter] += value
+
+    def finish(self):
+        self.wall_time = time.perf_counter() - self._start_counter
+
+    def get_summary(self) -> str:
+        """Return a single line describing where the time in the sync went."""
+        with self._lock:
+            phases = ", ".join("{0} {1:.2f}s".format(phase, duration) for phase, duration in self.durations.items())
+            counters = ", ".join("{0} {1}".format(value, counter) for counter, value in sorted(self.counters.items()) if value)
+        wall_time = self.wall_time if self.wall_time is not None else time.perf_counter() - self._start_counter
+        summary = "Sync took {0:.2f}s".format(wall_time)
+        if phases:
+            summary += " ({0})".format(phases)
+        if counters:
+            summary += ", {0}".format(counters)
+        return summary
+
+    def to_record(self) -> dict:
+        with self._lock:
+            return {
+                "start_time": self.start_time,
+                "wall_time": self.wall_time,
+                "durations": dict(self.durations),
+                "counters": dict(self.counters),
+            }
+
+
+def append_metrics_record(file_path: str, metrics: SyncMetrics, **fields):
+    """Append the metrics for a sync, along with any extra fields, to a JSON lines file."""
+    record = metrics.to_record()
+    record.update(fields)
+    Path(os.path.dirname(file_path) or ".").mkdir(parents=True, exist_ok=True)
+    with open(file_path, "a", encoding="utf-8") as metrics_file:
+        metrics_file.write(json.dumps(record) + "\n")
+
+
+def get_counter_deltas(before: Mapping[str, int] or None, after: Mapping[str, int] or None) -> Mapping[str, int]:
+    """Return how much each counter increased between two sets of counters, such as transport stats."""
+    if not after:
+        return {}
+    before = before or {}
+    return {name: value - before.get(name, 0) for name, value in after.items()}
+
+
+class InlineExecutor(object):
+    """Stand in for a ThreadPoolExecutor that runs each function as it's submitted, on the calling thread.
+    Used while profiling, as cProfile only sees the thread it was enabled on."""
+
+    def submit(self, function: Callable[..., T], *args, **kwargs) -> Future:
+        future = Future()
+        try:
+            future.set_result(function(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
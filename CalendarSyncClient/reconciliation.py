@@ -0,0 +1,191 @@
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple, Set, Tuple
+
+from service_connectors import ServiceConnector, AddonEvent, CalendarID, ChangeOperation, EventComparisonResult, RemoteEvent
+from state_store import CalendarState, PendingChange, hash_addon_event
+
+
+class ReconciliationResult(object):
+    """The changes required to bring a remote calendar in line with the addon events."""
+
+    def __init__(self):
+        self.creates: List[AddonEvent] = []
+        # (remote_event, addon_event) pairs.
+        self.updates: List[Tuple[RemoteEvent, AddonEvent]] = []
+        self.deletes: List[RemoteEvent] = []
+        self.unchanged: List[Tuple[RemoteEvent, AddonEvent]] = []
+        # (original event ID, addon_event) pairs for addon events given a sub-ID because their ID was already in use.
+        self.reassigned_ids: List[Tuple[str, AddonEvent]] = []
+        # Remote event key: (original addon event key, content hash) for every event that will be in sync once the
+        # changes are applied, for recording in the state store.
+        self.synced_events: Dict[str, Tuple[str, str]] = {}
+        # Remote event key: fields changed by each update.
+        self.changed_fields: Dict[str, FrozenSet[str]] = {}
+        # Every event ID in use on the remote calendar, for seeding the state store once the changes are applied.
+        # None if the calendar is already seeded or the IDs weren't fetched.
+        self.seed_keys: List[str] or None = None
+
+    def get_changes(self, service: ServiceConnector) -> List[PendingChange]:
+        """Return the creates, updates and deletes as a list of changes to apply."""
+        changes = []
+        for addon_event in self.creates:
+            key = service.get_addon_event_key(addon_event)
+            changes.append(PendingChange(ChangeOperation.CREATE, key, addon_event, self.synced_events[key]))
+        for remote_event, addon_event in self.updates:
+            key = service.get_remote_event_key(remote_event)
+            changes.append(PendingChange(ChangeOperation.UPDATE, key, (remote_event, addon_event), self.synced_events[key],
+                                         self.changed_fields[key]))
+        for remote_event in self.deletes:
+            changes.append(PendingChange(ChangeOperation.DELETE, service.get_remote_event_key(remote_event), remote_event))
+        return changes
+
+
+class CalendarSyncPlan(NamedTuple):
+    """The changes planned to sync a calendar to a service.
+    calendar_id is None if the calendar doesn't exist yet and needs creating before the changes are applied."""
+    calendar_name: str
+    calendar_id: CalendarID or None
+    reconciliation: ReconciliationResult
+    changes: List[PendingChange]
+
+
+def reconcile_events(service: ServiceConnector, calendar_id: CalendarID, addon_events: Iterable[AddonEvent],
+                     remote_events: Iterable[RemoteEvent], state: CalendarState = None) -> ReconciliationResult:
+    """Index both sides by the service's event keys and sort them into create/update/delete/unchanged sets.
+    compare_events is only called for addon and remote events that share a key.
+
+    If a state store is given, addon events are matched to the remote event they were last synced to, and are
+    unchanged if their content matches what was synced. Once the calendar is seeded, new event IDs are checked for
+    collisions against the store rather than the service. The state store is only read, the IDs to seed it with
+    are returned in seed_keys.
+    """
+    result = ReconciliationResult()
+    remote_index: Dict[str, RemoteEvent] = {}
+    for remote_event in remote_events:
+        remote_index[service.get_remote_event_key(remote_event)] = remote_event
+    matched_keys = set()
+
+    def match_remote_event(addon_event: AddonEvent, addon_event_key: str) -> bool:
+        key = service.get_addon_event_key(addon_event)
+        remote_event = remote_index.get(key)
+        if remote_event is None:
+            return False
+
+        event_comparison = service.compare_events(addon_event, remote_event)
+        if event_comparison is EventComparisonResult.EQUAL:
+            result.unchanged.append((remote_event, addon_event))
+        elif event_comparison is EventComparisonResult.UPDATED:
+            result.updates.append((remote_event, addon_event))
+            result.changed_fields[key] = frozenset(service.get_changed_fields(addon_event, remote_event))
+        else:
+            return False
+        matched_keys.add(key)
+        result.synced_events[key] = (addon_event_key, hash_addon_event(addon_event))
+        return True
+
+    def match_synced_event(addon_event: AddonEvent, addon_event_key: str) -> bool:
+        mapping = state.get_mapping(addon_event_key)
+        if mapping is None:
+            return False
+        remote_id, content_hash = mapping
+        remote_event = remote_index.get(remote_id)
+        if remote_event is None:
+            # The event has since been removed from the service.
+            return False
+
+        addon_event["eventID"] = remote_id
+        if content_hash != hash_addon_event(addon_event):
+            return match_remote_event(addon_event, addon_event_key)
+        result.unchanged.append((remote_event, addon_event))
+        matched_keys.add(remote_id)
+        result.synced_events[remote_id] = (addon_event_key, content_hash)
+        return True
+
+    unmatched_addon_events = []
+    for addon_event in addon_events:
+        # Ensure we're using IDs as strings for sub-id support.
+        addon_event_id = addon_event["eventID"] = str(addon_event["eventID"])
+        addon_event_key = service.get_addon_event_key(addon_event)
+        if state is not None and match_synced_event(addon_event, addon_event_key):
+            continue
+        addon_event["eventID"] = addon_event_id
+        if not match_remote_event(addon_event, addon_event_key):
+            unmatched_addon_events.append((addon_event, addon_event_key))
+
+    seeded = state is not None and state.is_seeded()
+    existing_events = None
+    if state is not None and not seeded:
+        # Record every ID in use on the calendar once, so later syncs can check new IDs locally.
+        existing_events = service.get_existing_events(calendar_id)
+        if existing_events is not None:
+            result.seed_keys = list(existing_events.keys())
+
+    if not unmatched_addon_events:
+        return _collect_deletes(result, remote_index, matched_keys)
+
+    # Catch WoW reusing old event IDs and support external events being created without ID conflicts.
+    # Every ID that could collide is fetched up front where supported, rather than requesting each new event.
+    if existing_events is None and (not seeded or any(
+            state.is_remote_id_used(key) for _, key in unmatched_addon_events)):
+        existing_events = service.get_existing_events(calendar_id)
+    for addon_event, addon_event_key in unmatched_addon_events:
+        while True:
+            key = service.get_addon_event_key(addon_event)
+            if seeded and key not in remote_index and not state.is_remote_id_used(key):
+                # The store knows every ID in use, so the ID is free without asking the service.
+                existing_event = None
+            elif existing_events is not None:
+                existing_event = existing_events.get(key)
+            else:
+                existing_event = service.get_event(calendar_id, addon_event)
+            if existing_event is None:
+                result.creates.append(addon_event)
+                result.synced_events[key] = (addon_event_key, hash_addon_event(addon_event))
+                break
+
+            result.reassigned_ids.append((addon_event["eventID"], addon_event))
+            addon_event["eventID"] = service.create_subid(addon_event, existing_event)
+            if match_remote_event(addon_event, addon_event_key):
+                break
+
+    return _collect_deletes(result, remote_index, matched_keys)
+
+
+def reconcile_journaled_events(service: ServiceConnector, calendar_id: CalendarID, addon_events: Iterable[AddonEvent],
+                               remote_events: Iterable[RemoteEvent], state: CalendarState,
+                               changed_event_ids: Set[str]) -> ReconciliationResult:
+    """Reconcile only the addon events the AddOn journaled as added, changed or removed since the calendar was last
+    synced, along with the remote events they were synced to. Every other event is assumed to still be in sync.
+    The calendar must be seeded, so new event IDs can be checked for collisions against the store."""
+    changed_addon_events = [addon_event for addon_event in addon_events if str(addon_event["eventID"]) in changed_event_ids]
+    remote_keys = set()
+    for event_id in changed_event_ids:
+        # Removed events only have an ID left to look up the remote event they were synced to.
+        addon_event_key = service.get_addon_event_key({"eventID": event_id})
+        remote_keys.add(addon_event_key)
+        mapping = state.get_mapping(addon_event_key)
+        if mapping is not None:
+            remote_keys.add(mapping[0])
+    remote_events = (remote_event for remote_event in remote_events if service.get_remote_event_key(remote_event) in remote_keys)
+    return reconcile_events(service, calendar_id, changed_addon_events, remote_events, state)
+
+
+def reconcile_new_calendar(service: ServiceConnector, addon_events: Iterable[AddonEvent]) -> ReconciliationResult:
+    """Return the changes to sync the addon events to a calendar that doesn't exist yet, which are all creates."""
+    result = ReconciliationResult()
+    # A new calendar has no events, so it's seeded without asking the service for the IDs in use.
+    result.seed_keys = []
+    for addon_event in addon_events:
+        addon_event["eventID"] = str(addon_event["eventID"])
+        key = service.get_addon_event_key(addon_event)
+        result.creates.append(addon_event)
+        result.synced_events[key] = (key, hash_addon_event(addon_event))
+    return result
+
+
+def _collect_deletes(result: ReconciliationResult, remote_index: Dict[str, RemoteEvent], matched_keys: Set[str]) -> ReconciliationResult:
+    """Add every remote event that wasn't matched to an addon event to the deletes set."""
+    for key, remote_event in remote_index.items():
+        if key not in matched_keys:
+            result.deletes.append(remote_event)
+
+    return result
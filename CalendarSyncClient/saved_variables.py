@@ -0,0 +1,288 @@
+"""Parser for the subset of Lua written by WoW to SavedVariables files.
+
+Values are decoded the same way as slpp for the tables WoW writes: tables only containing implicitly indexed values
+become lists, any other table becomes a dict. Only the value at the requested path is decoded; any other value is skipped over without building
+Python objects for it.
+"""
+import re
+from typing import Any, Sequence
+
+# Whitespace and comments between tokens.
+_WHITESPACE_RE = re.compile(r"(?:\s+|--\[(=*)\[.*?\]\1\]|--[^\n]*)*", re.S)
+_NAME_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_NUMBER_RE = re.compile(r"-?(?:0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)")
+_STRING_RES = {
+    "\"": re.compile(r'"([^"\\\n]*(?:\\.[^"\\\n]*)*)"', re.S),
+    "'": re.compile(r"'([^'\\\n]*(?:\\.[^'\\\n]*)*)'", re.S),
+}
+_LONG_STRING_RE = re.compile(r"\[(=*)\[\n?(.*?)\]\1\]", re.S)
+# Runs of decimal and hex escapes are matched together, as they're bytes that may only form a character together.
+_ESCAPE_RE = re.compile(r"((?:\\(?:\d{1,3}|x[0-9a-fA-F]{2}))+)|\\(?:u\{([0-9a-fA-F]+)\}|z\s*|(.))", re.S)
+_BYTE_ESCAPE_RE = re.compile(r"\\(?:(\d{1,3})|x([0-9a-fA-F]{2}))")
+_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "a": "\a", "b": "\b", "f": "\f", "v": "\v", "\n": "\n"}
+# Strings, comments and anything else up to the next brace, so only braces are handled in Python when skipping a table.
+_SKIP_RE = re.compile(r"""(?:[^{}"'\-\[]+|"[^"\\\n]*(?:\\.[^"\\\n]*)*"|'[^'\\\n]*(?:\\.[^'\\\n]*)*'|--\[(=*)\[.*?\]\1\]|--[^\n]*"""
+                      r"""|\[(=*)\[.*?\]\2\]|[-\[])*""", re.S)
+# A ["key"] = "string" or integer field, including its separator.
+_SIMPLE_FIELD_RE = re.compile(r'\["([^"\\\n]*(?:\\.[^"\\\n]*)*)"\]\s*=\s*(?:"([^"\\\n]*(?:\\.[^"\\\n]*)*)"|(-?\d+)(?![\d.xXeE]))\s*[,;]?')
+# An implicitly indexed string or integer value, including its separator.
+_SIMPLE_VALUE_RE = re.compile(r'(?:"([^"\\\n]*(?:\\.[^"\\\n]*)*)"|(-?\d+)(?![\d.xXeE]))\s*[,;]')
+_KEYWORDS = {"true": True, "false": False, "nil": None}
+
+
+class SavedVariablesError(ValueError):
+    pass
+
+
+def read_saved_variable(file_path: str, path: Sequence[Any]) -> Any:
+    """Read a SavedVariables file and decode the value at path.
+    path starts with the global variable name followed by the table keys to descend through,
+    for example ("CalendarSyncDB", "profiles", "Default").
+    """
+    with open(file_path, "r", encoding="utf-8") as data_file:
+        return decode_path(data_file.read(), path)
+
+
+def decode_path(text: str, path: Sequence[Any]) -> Any:
+    """Decode the value at path from SavedVariables text, skipping everything else. Raises KeyError if not found."""
+    return _Parser(text).decode_path(path)
+
+
+def decode(text: str) -> dict:
+    """Decode every global variable assignment in SavedVariables text."""
+    return _Parser(text).decode_globals()
+
+
+def _unescape_match(match) -> str:
+    byte_escapes, codepoint, char = match.groups()
+    if byte_escapes is not None:
+        # Lua strings are bytes, so escaped bytes are decoded as UTF-8 like the rest of the file.
+        escaped_bytes = [int(decimal) if decimal else int(hexadecimal, 16)
+                         for decimal, hexadecimal in _BYTE_ESCAPE_RE.findall(byte_escapes)]
+        if max(escaped_bytes) > 255:
+            raise SavedVariablesError("Decimal escape too large in {0}".format(byte_escapes))
+        return bytes(escaped_bytes).decode("utf-8", errors="replace")
+    if codepoint is not None:
+        return chr(int(codepoint, 16))
+    if char is None:
+        # \z skips the following whitespace.
+        return ""
+    return _ESCAPES.get(char, char)
+
+
+class _Parser(object):
+
+    def __init__(self, text: str):
+        self.text = text
+        self.pos = 0
+
+    def decode_globals(self) -> dict:
+        values = {}
+        while self._skip_whitespace() < len(self.text):
+            name = self._parse_assignment_name()
+            values[name] = self._parse_value()
+        return values
+
+    def decode_path(self, path: Sequence[Any]) -> Any:
+        if not path:
+            return self.decode_globals()
+
+        while self._skip_whitespace() < len(self.text):
+            name = self._parse_assignment_name()
+            if name == path[0]:
+                return self._decode_value_path(path[1:])
+            self._skip_value()
+        raise KeyError(path[0])
+
+    def _decode_value_path(self, path: Sequence[Any]) -> Any:
+        if not path:
+            return self._parse_value()
+
+        if self._peek() != "{":
+            raise KeyError(path[0])
+        self.pos += 1
+        implicit_index = 1
+        while True:
+            char = self._peek()
+            if char == "}":
+                raise KeyError(path[0])
+
+            key, implicit_index = self._parse_table_key(implicit_index)
+            if key == path[0]:
+                return self._decode_value_path(path[1:])
+            self._skip_value()
+            self._parse_field_separator()
+
+    def _error(self, message: str):
+        line = self.text.count("\n", 0, self.pos) + 1
+        raise SavedVariablesError("{0} at line {1}".format(message, line))
+
+    def _skip_whitespace(self) -> int:
+        self.pos = _WHITESPACE_RE.match(self.text, self.pos).end()
+        return self.pos
+
+    def _peek(self) -> str:
+        self._skip_whitespace()
+        return self.text[self.pos:self.pos + 1]
+
+    def _parse_assignment_name(self) -> str:
+        match = _NAME_RE.match(self.text, self.pos)
+        if not match:
+            self._error("Expected variable name")
+        self.pos = match.end()
+        if self._peek() != "=":
+            self._error("Expected '=' after {0}".format(match.group()))
+        self.pos += 1
+        return match.group()
+
+    def _parse_table_key(self, implicit_index: int):
+        """Parse the key of the next table field, leaving pos at its value.
+        Return the key and the next implicit array index."""
+        text = self.text
+        if text.startswith("[", self.pos) and not _LONG_STRING_RE.match(text, self.pos):
+            self.pos += 1
+            key = self._parse_value()
+            if self._peek() != "]":
+                self._error("Expected ']' after table key")
+            self.pos += 1
+            if self._peek() != "=":
+                self._error("Expected '=' after table key")
+            self.pos += 1
+            return key, implicit_index
+
+        match = _NAME_RE.match(text, self.pos)
+        if match and match.group() not in _KEYWORDS:
+            end = match.end()
+            self.pos = end
+            if self._peek() == "=" and not text.startswith("==", self.pos):
+                self.pos += 1
+                return match.group(), implicit_index
+            self.pos = end
+            self._error("Unexpected name {0}".format(match.group()))
+
+        return implicit_index, implicit_index + 1
+
+    def _parse_field_separator(self):
+        char = self._peek()
+        if char == "," or char == ";":
+            self.pos += 1
+        elif char != "}":
+            self._error("Expected ',' or '}' in table")
+
+    def _parse_value(self) -> Any:
+        char = self._peek()
+        text = self.text
+        if char == "{":
+            return self._parse_table()
+        if char == "\"" or char == "'":
+            match = _STRING_RES[char].match(text, self.pos)
+            if not match:
+                self._error("Unterminated string")
+            self.pos = match.end()
+            value = match.group(1)
+            if "\\" in value:
+                value = _ESCAPE_RE.sub(_unescape_match, value)
+            return value
+        if char == "[":
+            match = _LONG_STRING_RE.match(text, self.pos)
+            if not match:
+                self._error("Unexpected '['")
+            self.pos = match.end()
+            return match.group(2)
+
+        match = _NUMBER_RE.match(text, self.pos)
+        if match:
+            self.pos = match.end()
+            number = match.group()
+            if "x" in number or "X" in number:
+                return int(number, 16)
+            if "." in number or "e" in number or "E" in number:
+                return float(number)
+            return int(number)
+
+        match = _NAME_RE.match(text, self.pos)
+        if match and match.group() in _KEYWORDS:
+            self.pos = match.end()
+            return _KEYWORDS[match.group()]
+
+        if not char:
+            self._error("Unexpected end of file")
+        self._error("Unexpected character {0!r}".format(char))
+
+    def _parse_table(self):
+        text = self.text
+        self.pos += 1
+        table = {}
+        array_values = []
+        has_explicit_keys = False
+        implicit_index = 1
+        while self._peek() != "}":
+            # Fast path for the ["key"] = "string" or number fields making up most of the file.
+            match = _SIMPLE_FIELD_RE.match(text, self.pos)
+            if match:
+                key, string_value, number_value = match.groups()
+                if "\\" in key:
+                    key = _ESCAPE_RE.sub(_unescape_match, key)
+                if string_value is None:
+                    table[key] = int(number_value)
+                elif "\\" in string_value:
+                    table[key] = _ESCAPE_RE.sub(_unescape_match, string_value)
+                else:
+                    table[key] = string_value
+                has_explicit_keys = True
+                self.pos = match.end()
+                continue
+            # Fast path for the string and number arrays making up the compact export.
+            match = _SIMPLE_VALUE_RE.match(text, self.pos)
+            if match:
+                string_value, number_value = match.groups()
+                if string_value is None:
+                    value = int(number_value)
+                elif "\\" in string_value:
+                    value = _ESCAPE_RE.sub(_unescape_match, string_value)
+                else:
+                    value = string_value
+                array_values.append(value)
+                table[implicit_index] = value
+                implicit_index += 1
+                self.pos = match.end()
+                continue
+
+            key, next_implicit_index = self._parse_table_key(implicit_index)
+            value = self._parse_value()
+            if next_implicit_index != implicit_index:
+                array_values.append(value)
+            else:
+                has_explicit_keys = True
+            if value is not None:
+                table[key] = value
+            implicit_index = next_implicit_index
+            self._parse_field_separator()
+        self.pos += 1
+
+        # Tables only containing implicitly indexed values are arrays.
+        if array_values and not has_explicit_keys:
+            return array_values
+        return table
+
+    def _skip_value(self):
+        """Move past the next value without decoding it."""
+        if self._peek() != "{":
+            self._parse_value()
+            return
+
+        text = self.text
+        depth = 0
+        while True:
+            self.pos = _SKIP_RE.match(text, self.pos).end()
+            char = text[self.pos:self.pos + 1]
+            if char == "{":
+                depth += 1
+            elif char == "}":
+                depth -= 1
+            else:
+                break
+            self.pos += 1
+            if depth == 0:
+                return
+        self._error("Unterminated table")
@@ -1,13 +1,27 @@
 import configparser
+import importlib
+import importlib.util
 import logging
 import os
+import tempfile
+import threading
+import time
 from abc import abstractmethod, ABCMeta
 from enum import IntEnum, unique, auto
 from pathlib import Path
 from sys import exit
-from typing import Any, NewType, Mapping, Sequence
+from typing import Any, Callable, Iterator, List, NamedTuple, NewType, Mapping, Sequence, Set, Tuple, TypeVar
+
+from .rate_limiter import RetryPolicy, TokenBucket
 
 SERVICE_DATA_ROOT = "data/"
+DEFAULT_MAX_RETRIES = 5
+
+# Connector name: module providing get_connector(config). Names match each connector's service_name.
+# Connectors in this package that aren't registered are found by their file name.
+_connector_modules = {}
+
+T = TypeVar("T")
 
 # Type that identifies a calendar on the remote service.
 CalendarID = NewType("CalendarID", Any)
@@ -23,6 +37,14 @@ AddonEvent = NewType("AddonEvent", Mapping[str, Any])
 ["creator"] = "Player Name",
 ["description"] = "Event description",
 """
+# AddonEvent fields synced to services, see ServiceConnector.get_changed_fields.
+SYNCED_FIELDS = frozenset(("title", "startTime", "endTime", "creator", "description"))
+
+
+class CalendarNotFoundError(Exception):
+    """Raised when a calendar ID returned by get_calender_id_by_name no longer exists on the service.
+    Connectors caching calendar IDs should forget the ID before raising this."""
+    pass
 
 
 @unique
@@ -32,15 +54,46 @@ class EventComparisonResult(IntEnum):
     DIFFERENT = auto()
 
 
+@unique
+class ChangeOperation(IntEnum):
+    CREATE = auto()
+    UPDATE = auto()
+    DELETE = auto()
+
+
+class FailedChange(NamedTuple):
+    """A change passed to ServiceConnector.apply_changes that couldn't be applied.
+    event is the AddonEvent for creates, the (RemoteEvent, AddonEvent) pair for updates and the RemoteEvent for deletes.
+    """
+    operation: ChangeOperation
+    event: Any
+    error: Exception
+
+
 class ServiceConnector(metaclass=ABCMeta):
     """ Base class for API services."""
 
+    # Whether the connector's methods can be called from multiple threads at once.
+    # Calendars for connectors that aren't thread safe are synced one at a time.
+    thread_safe = False
+    # Requests per second allowed by the service's quota, or None for no limit. Overridden by MaxRequestsPerSecond.
+    default_max_requests_per_second = None
+
     def __init__(self, service_file, config):
         self.service_name = os.path.splitext(os.path.basename(service_file))[0]
         self.data_path = os.path.join(SERVICE_DATA_ROOT, self.service_name)
         self.config = config
         self.logger = logging.getLogger(self.service_name)
 
+        max_requests_per_second = self.get_optional_config_option("MaxRequestsPerSecond", self.default_max_requests_per_second)
+        self.rate_limiter = TokenBucket(float(max_requests_per_second) if max_requests_per_second else None)
+        self.retry_policy = RetryPolicy(int(self.get_optional_config_option("MaxRetries", DEFAULT_MAX_RETRIES)))
+        # Requests sent through call_with_retry and the number of those that were retries, since the connector was created.
+        self.request_count = 0
+        self.retry_count = 0
+        # Guards the counters, as thread safe connectors send requests from several threads at once.
+        self.stats_lock = threading.Lock()
+
     def get_data_file_path(self, file_name):
         if not os.path.exists(self.data_path):
             Path(self.data_path).mkdir(parents=True, exist_ok=True)
@@ -54,6 +107,55 @@ class ServiceConnector(metaclass=ABCMeta):
             input()
             exit()
 
+    def get_optional_config_option(self, option, fallback):
+        """Return the specified option from the service config, or fallback if it isn't set."""
+        return self.config.get(option) or fallback
+
+    def call_with_retry(self, request: Callable[[], T], cost: int = 1) -> T:
+        """Call request once the rate limiter allows cost requests, returning its result.
+        Failures that is_rate_limit_error considers temporary are retried with jittered exponential backoff.
+        """
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire(cost)
+            with self.stats_lock:
+                self.request_count += cost
+            try:
+                return request()
+            except Exception as e:
+                if attempt >= self.retry_policy.max_retries or not self.is_rate_limit_error(e):
+                    raise
+                delay = self.retry_policy.get_delay(attempt, self.get_retry_after(e))
+                self.logger.warning("Request rate limited, retrying in {0:.1f}s: {1}".format(delay, e))
+                time.sleep(delay)
+                attempt += 1
+                with self.stats_lock:
+                    self.retry_count += 1
+
+    def is_rate_limit_error(self, error: Exception) -> bool:
+        """Return whether error is a rate limit or other temporary failure that should be retried after a delay.
+
+        Override to implement service specific behaviour.
+        """
+        return False
+
+    def get_retry_after(self, error: Exception) -> float or None:
+        """Return the seconds the service asked to wait before retrying after error, or None if it didn't say.
+
+        Override to implement service specific behaviour.
+        """
+        return None
+
+    def get_request_stats(self) -> Mapping[str, int]:
+        """Return the number of requests sent through call_with_retry and retried since the connector was created."""
+        with self.stats_lock:
+            return {"requests": self.request_count, "retries": self.retry_count}
+
+    def get_transport_stats(self) -> Mapping[str, int] or None:
+        """Return counters describing the service's network usage since the connector was created,
+        such as connections opened and requests sent, or None if the service doesn't track them."""
+        return None
+
     @abstractmethod
     def get_calender_id_by_name(self, calendar_name: str) -> CalendarID:
         """Return a calendar identifier for the specified calendar name,
@@ -80,23 +182,105 @@ class ServiceConnector(metaclass=ABCMeta):
 
     @abstractmethod
     def update_event(self, calendar_id: CalendarID, remote_event: RemoteEvent, addon_event: AddonEvent):
-        """Update the specified remote event to match the new addon_event data."""
+        """Update the specified remote event to match the new addon_event data.
+        Services should only send the fields returned by get_changed_fields."""
         ...
 
+    def apply_changes(self, calendar_id: CalendarID, creates: Sequence[AddonEvent],
+                      updates: Sequence[Tuple[RemoteEvent, AddonEvent]], deletes: Sequence[RemoteEvent]) -> List[FailedChange]:
+        """Apply a set of changes to the specified calendar, returning the changes that failed.
+        A failing change must not prevent the remaining changes from being applied.
+
+        Falls back to create_event, update_event and remove_event for each change.
+        Override to implement service specific bulk requests.
+        """
+        failed_changes = []
+        for addon_event in creates:
+            try:
+                self.create_event(calendar_id, addon_event)
+            except Exception as e:
+                failed_changes.append(FailedChange(ChangeOperation.CREATE, addon_event, e))
+
+        for remote_event, addon_event in updates:
+            try:
+                self.update_event(calendar_id, remote_event, addon_event)
+            except Exception as e:
+                failed_changes.append(FailedChange(ChangeOperation.UPDATE, (remote_event, addon_event), e))
+
+        for remote_event in deletes:
+            try:
+                self.remove_event(calendar_id, remote_event)
+            except Exception as e:
+                failed_changes.append(FailedChange(ChangeOperation.DELETE, remote_event, e))
+
+        return failed_changes
+
+    def is_change_already_applied(self, operation: ChangeOperation, error: Exception) -> bool:
+        """Return whether a change failed with error because it had already been applied,
+        such as creating an event whose ID exists or removing one that's gone.
+        Used when changes left over from an interrupted sync are applied again.
+
+        Override to implement service specific behaviour.
+        """
+        return False
+
     @abstractmethod
     def get_event(self, calendar_id: CalendarID, addon_event: AddonEvent) -> RemoteEvent or None:
         """Get the remote event for an addon event, or None if it doesn't exist."""
         ...
 
+    def get_existing_events(self, calendar_id: CalendarID) -> Mapping[str, RemoteEvent] or None:
+        """Return every event whose ID could collide with a new event, keyed by get_remote_event_key.
+        This includes past and removed events, as well as those returned by get_events.
+        Fetched once per sync to resolve reused IDs and sub-IDs without a request per new event.
+
+        Return None if the service can't list these, in which case get_event is called for each new event.
+        """
+        return None
+
     @abstractmethod
-    def get_events(self, calendar_id: CalendarID, lookahead_days: int) -> Sequence[RemoteEvent]:
+    def get_events(self, calendar_id: CalendarID, lookahead_days: int) -> Iterator[RemoteEvent]:
+        """Return an iterator over the upcoming events on the specified calendar, up to lookahead_days ahead.
+        The iterator is consumed once per sync. Services should fetch results lazily, one page at a time as the iterator
+        is consumed, rather than requesting every event up front or guessing at a single page size.
+        """
         ...
 
+    @abstractmethod
+    def get_remote_event_key(self, remote_event: RemoteEvent) -> str:
+        """Return the normalised event ID of the specified remote event from get_events.
+        Remote events are matched to addon events with the same key, see get_addon_event_key."""
+        ...
+
+    def get_addon_event_key(self, addon_event: AddonEvent) -> str:
+        """Return the normalised event ID of the specified addon event, matching the format of get_remote_event_key.
+
+        Override to implement service specific behaviour.
+        """
+        return str(addon_event["eventID"]).strip()
+
     @abstractmethod
     def compare_events(self, addon_event: AddonEvent, remote_event: RemoteEvent) -> EventComparisonResult:
-        """Return the relationship between the addon_event and the relating remote event from get_events."""
+        """Return the relationship between the addon_event and the relating remote event from get_events.
+        Only called for events that share a key, see get_remote_event_key."""
         ...
 
+    def get_changed_fields(self, addon_event: AddonEvent, remote_event: RemoteEvent) -> Set[str]:
+        """Return the SYNCED_FIELDS of the addon_event that differ from the relating remote event from get_events.
+        Only called for events that share a key and compare as UPDATED.
+
+        Defaults to every synced field. Override so updates only send the fields that changed.
+        """
+        return set(SYNCED_FIELDS)
+
+    def get_request_count(self, change_count: int) -> int:
+        """Return the number of requests apply_changes sends to apply change_count changes, used to estimate the cost
+        of a sync plan. Defaults to a request per change.
+
+        Override to implement service specific behaviour.
+        """
+        return change_count
+
     @abstractmethod
     def event_tostring(self, remote_event: RemoteEvent) -> str:
         """Return a string representation of the specified remote event from get_events."""
@@ -113,3 +297,76 @@ class ServiceConnector(metaclass=ABCMeta):
         Override to implement service specific behaviour.
         """
         return addon_event["eventID"] + "a"
+
+
+class LazyServiceConnector(object):
+    """Stands in for a ServiceConnector, only importing its module and creating it when it's first used.
+    This keeps connectors and the libraries they import out of startup and syncs with nothing to change.
+    Until then, the connector is treated as having sent no requests.
+    """
+
+    def __init__(self, connector_name: str, config):
+        self.service_name = connector_name
+        self.config = config
+        self._connector = None
+        self._load_lock = threading.Lock()
+        self.module_name = get_connector_module_name(connector_name)
+        # Checked up front so a misspelt service fails on startup rather than on the first sync that needs it.
+        if importlib.util.find_spec(self.module_name) is None:
+            raise ModuleNotFoundError("No service connector named {0}".format(connector_name), name=self.module_name)
+
+    def is_loaded(self) -> bool:
+        return self._connector is not None
+
+    def get_connector(self) -> ServiceConnector:
+        if self._connector is None:
+            with self._load_lock:
+                if self._connector is None:
+                    module = importlib.import_module(self.module_name)
+                    self._connector = getattr(module, "get_connector")(self.config)
+        return self._connector
+
+    def get_request_stats(self) -> Mapping[str, int] or None:
+        if self._connector is None:
+            return None
+        return self._connector.get_request_stats()
+
+    def get_transport_stats(self) -> Mapping[str, int] or None:
+        if self._connector is None:
+            return None
+        return self._connector.get_transport_stats()
+
+    def __getattr__(self, name):
+        # Only called for attributes not set above, so anything else loads the connector.
+        return getattr(self.get_connector(), name)
+
+
+def register_connector(connector_name: str, module_name: str):
+    """Register the module providing get_connector(config) for a connector, without importing it."""
+    _connector_modules[connector_name] = module_name
+
+
+def get_connector_module_name(connector_name: str) -> str:
+    return _connector_modules.get(connector_name, "{0}.{1}".format(__name__, connector_name))
+
+
+def write_file_atomically(file_path: str, chunks: Sequence[bytes]):
+    """Write the chunks to a temporary file alongside file_path, then rename it over file_path so readers only ever
+    see the old or the new version of the file."""
+    file_descriptor, temp_file_path = tempfile.mkstemp(dir=os.path.dirname(file_path) or ".",
+                                                       prefix="." + os.path.basename(file_path), suffix=".tmp")
+    try:
+        with os.fdopen(file_descriptor, "wb") as temp_file:
+            temp_file.writelines(chunks)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.replace(temp_file_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+        raise
+
+
+register_connector("google_calendar", __name__ + ".google_calendar")
+register_connector("ics_file", __name__ + ".ics_file")
+register_connector("example_connector", __name__ + ".example_connector")
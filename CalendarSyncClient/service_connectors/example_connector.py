@@ -1,4 +1,4 @@
-from typing import Sequence
+from typing import Iterator
 
 from . import ServiceConnector, EventComparisonResult, CalendarID, RemoteEvent, AddonEvent
 
@@ -25,7 +25,13 @@ class ExampleServiceConnector(ServiceConnector):
     def update_event(self, calendar_id: CalendarID, remote_event: RemoteEvent, addon_event: AddonEvent):
         pass
 
-    def get_events(self, calendar_id: CalendarID, lookahead_days: int) -> Sequence[RemoteEvent]:
+    def get_event(self, calendar_id: CalendarID, addon_event: AddonEvent) -> RemoteEvent or None:
+        pass
+
+    def get_events(self, calendar_id: CalendarID, lookahead_days: int) -> Iterator[RemoteEvent]:
+        pass
+
+    def get_remote_event_key(self, remote_event: RemoteEvent) -> str:
         pass
 
     def compare_events(self, addon_event: AddonEvent, remote_event: RemoteEvent) -> EventComparisonResult:
@@ -1,72 +1,213 @@
+import json
 import os
 import pickle
-from datetime import datetime
-from functools import wraps
-from typing import Sequence
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+from functools import partial, wraps
+from typing import Any, Collection, Dict, Iterator, List, Mapping, Sequence, Set, Tuple
+from urllib.request import urlopen
 
 import pytz
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+import pyrfc3339
 
-from . import ServiceConnector, CalendarID, EventComparisonResult, RemoteEvent, AddonEvent
+from . import ServiceConnector, CalendarID, CalendarNotFoundError, ChangeOperation, EventComparisonResult, FailedChange, \
+    RemoteEvent, AddonEvent, SYNCED_FIELDS, write_file_atomically
+
+# googleapiclient, google-auth, oauthlib, httplib2 and requests take longer to import than the rest of the client,
+# so they're imported by the methods that authorise or send requests, leaving syncs with nothing to change without them.
 
 CLIENT_SCOPES = ['https://www.googleapis.com/auth/calendar']
+DISCOVERY_URL = "https://www.googleapis.com/discovery/v1/apis/calendar/v3/rest"
+# Credentials are refreshed this long before they expire so requests never go out with an expired token.
+CREDENTIALS_REFRESH_MARGIN = timedelta(minutes=5)
+DEFAULT_HTTP_POOL_SIZE = 10
+# Seconds to wait for the API to respond before giving up on a request.
+HTTP_TIMEOUT = 60
+# Statuses and 403 reasons the Calendar API uses for temporary failures that should be retried with backoff.
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
 # Custom addition to append to the description as GCal doesn't support arbitrary creator strings.
 CREATED_BY_STRING = "\n\n~ Created by"
+# Maximum number of requests the Calendar API accepts in a single batch request.
+MAX_BATCH_SIZE = 50
+# Default and maximum page sizes the Calendar API accepts when listing events.
+DEFAULT_LIST_PAGE_SIZE = 250
+MAX_LIST_PAGE_SIZE = 2500
+MAX_CALENDAR_LIST_PAGE_SIZE = 250
 
 
 def requires_google_auth(f):
     """ Decorator for methods requiring google OAuth authorisation.
     "credentials" and "api" will be set on the calling object.
+    Checked in memory against the credentials' expiry, only touching disk or the network to refresh or reauthorise.
     """
 
     @wraps(f)
     def wrapper(service_connector: ServiceConnector, *args, **kwargs):
-        reauth_required = False
-        token_file_path = service_connector.get_data_file_path("token.pickle")
-        credentials_file_path = service_connector.get_config_option("CredentialsFile")
-
-        if not service_connector.credentials:
-            if os.path.exists(token_file_path):
-                with open(token_file_path, "rb") as token_file:
-                    service_connector.credentials = pickle.load(token_file)
-
-        if not service_connector.credentials or not service_connector.credentials.valid:
-            if service_connector.credentials and service_connector.credentials.expired and service_connector.credentials.refresh_token:
-                service_connector.credentials.refresh(Request())
-            else:
-                flow = InstalledAppFlow.from_client_secrets_file(credentials_file_path, CLIENT_SCOPES)
-                service_connector.credentials = flow.run_local_server(port=8080)
-
-            with open(token_file_path, "wb") as token_file:
-                pickle.dump(service_connector.credentials, token_file)
-            reauth_required = True
-
-        if not service_connector.api or reauth_required:
-            service_connector.api = build("calendar", "v3", credentials=service_connector.credentials, cache_discovery=False)
+        if service_connector.api is None or service_connector.credentials_expiring():
+            with service_connector.auth_lock:
+                # Another thread may have authorised while this one was waiting.
+                if service_connector.api is None or service_connector.credentials_expiring():
+                    service_connector.authorise()
 
         return f(service_connector, *args, **kwargs)
 
     return wrapper
 
 
+class PooledHttp(object):
+    """An httplib2.Http compatible transport for googleapiclient using a pooled, keep-alive requests session.
+    Unlike httplib2, this can be shared between threads. Credentials are applied and refreshed by the session.
+    """
+
+    def __init__(self, credentials, pool_size: int):
+        from google.auth.transport.requests import AuthorizedSession
+        from requests.adapters import HTTPAdapter
+
+        self.session = AuthorizedSession(credentials)
+        self.adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", self.adapter)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._stats_lock = threading.Lock()
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        import httplib2
+
+        response = self.session.request(method, uri, data=body, headers=headers, timeout=HTTP_TIMEOUT)
+        response_info = dict(response.headers)
+        response_info["status"] = str(response.status_code)
+        http_response = httplib2.Response(response_info)
+        http_response.reason = response.reason
+        with self._stats_lock:
+            self.bytes_sent += len(body) if body else 0
+            self.bytes_received += len(response.content)
+        return http_response, response.content
+
+    def get_connection_stats(self) -> Dict[str, int]:
+        """Return the number of connections opened, requests sent over them and bytes transferred
+        since the transport was created."""
+        pools = [self.adapter.poolmanager.pools[key] for key in self.adapter.poolmanager.pools.keys()]
+        return {
+            "connections": sum(pool.num_connections for pool in pools),
+            "requests": sum(pool.num_requests for pool in pools),
+            "bytes sent": self.bytes_sent,
+            "bytes received": self.bytes_received,
+        }
+
+
 class GoogleCalendarServiceConnector(ServiceConnector):
+    # Requests go through a thread safe PooledHttp transport and cached state is guarded by cache_lock.
+    thread_safe = True
+    # The Calendar API's default per-user quota is 600 requests a minute.
+    default_max_requests_per_second = 10
 
     def __init__(self, config):
         super().__init__(__file__, config)
         self.api = None
         self.credentials = None
+        # Token last written to token.pickle, to avoid rewriting it when nothing has changed.
+        self.saved_token = None
+        self.http = None
+        self.http_pool_size = int(self.get_optional_config_option("HttpPoolSize", DEFAULT_HTTP_POOL_SIZE))
+        self.auth_lock = threading.Lock()
+        # Guards the calendar ID cache and remote snapshots when syncing calendars concurrently.
+        self.cache_lock = threading.RLock()
+        # Calendar ID: {"sync_token": str, "events": {event ID: RemoteEvent}}, including cancelled events.
+        self.remote_snapshots = {}
+        # Calendar name: Calendar ID, loaded on first use.
+        self.calendar_ids = None
+        self.page_size = min(int(self.get_optional_config_option("PageSize", DEFAULT_LIST_PAGE_SIZE)), MAX_LIST_PAGE_SIZE)
+
+    def credentials_expiring(self) -> bool:
+        """Return whether the credentials have expired or are about to."""
+        if self.credentials is None or self.credentials.expiry is None:
+            return False
+        # google-auth expiry times are naive UTC.
+        return self.credentials.expiry - CREDENTIALS_REFRESH_MARGIN <= datetime.utcnow()
+
+    def authorise(self):
+        """Load, refresh or request credentials as required and build the API client if it hasn't been built."""
+        from google.auth.transport.requests import Request
+        from google_auth_oauthlib.flow import InstalledAppFlow
+        from googleapiclient.discovery import build_from_document
+
+        token_file_path = self.get_data_file_path("token.pickle")
+        credentials = self.credentials
+        if credentials is None and os.path.exists(token_file_path):
+            with open(token_file_path, "rb") as token_file:
+                credentials = pickle.load(token_file)
+            self.saved_token = credentials.token
+
+        if credentials is not None and credentials.refresh_token and (not credentials.valid or self.credentials_expiring()):
+            # Refreshing updates the credentials in place, so an existing API client picks up the new token.
+            credentials.refresh(Request())
+        elif credentials is None or not credentials.valid:
+            flow = InstalledAppFlow.from_client_secrets_file(self.get_config_option("CredentialsFile"), CLIENT_SCOPES)
+            credentials = flow.run_local_server(port=8080)
+            self.api = None
+            self.http = None
+
+        if credentials.token != self.saved_token:
+            with open(token_file_path, "wb") as token_file:
+                pickle.dump(credentials, token_file)
+            self.saved_token = credentials.token
+        self.credentials = credentials
+
+        if self.api is None:
+            self.http = PooledHttp(self.credentials, self.http_pool_size)
+            self.api = build_from_document(self._get_discovery_document(), http=self.http)
+
+    def get_transport_stats(self) -> Mapping[str, int] or None:
+        if self.http is None:
+            return None
+        return self.http.get_connection_stats()
+
+    def _get_discovery_document(self) -> str:
+        """Return the Calendar API discovery document, only downloading it if it isn't cached on disk."""
+        discovery_file_path = self.get_data_file_path("calendar_v3_discovery.json")
+        if os.path.exists(discovery_file_path):
+            try:
+                with open(discovery_file_path, "r", encoding="utf-8") as discovery_file:
+                    discovery_document = discovery_file.read()
+                json.loads(discovery_document)
+                return discovery_document
+            except ValueError:
+                self.logger.warning("Ignoring unreadable {0}, downloading it again.".format(discovery_file_path))
+
+        with urlopen(DISCOVERY_URL, timeout=HTTP_TIMEOUT) as response:
+            discovery_bytes = response.read()
+        discovery_document = discovery_bytes.decode("utf-8")
+        # Checked before caching, so a truncated download isn't reused.
+        json.loads(discovery_document)
+        write_file_atomically(discovery_file_path, [discovery_bytes])
+        return discovery_document
 
     @requires_google_auth
     def get_calender_id_by_name(self, calendar_name: str) -> CalendarID:
-        calendars = self.api.calendarList().list().execute()
-        for calendar in calendars["items"]:
-            if calendar["summary"] == calendar_name:
-                return calendar["id"]
+        # Cached IDs are validated lazily, with _iter_event_pages removing them if the calendar no longer exists.
+        with self.cache_lock:
+            calendar_ids = self._get_calendar_ids()
+            if calendar_name in calendar_ids:
+                return calendar_ids[calendar_name]
 
-        return None
+            calendar_ids.clear()
+            page_token = None
+            while True:
+                calendars = self.call_with_retry(self.api.calendarList().list(
+                    maxResults=MAX_CALENDAR_LIST_PAGE_SIZE, pageToken=page_token, fields="items(id,summary),nextPageToken").execute)
+                for calendar in calendars.get("items", []):
+                    # Keep the first calendar listed for each name.
+                    calendar_ids.setdefault(calendar["summary"], calendar["id"])
+                page_token = calendars.get("nextPageToken")
+                if not page_token:
+                    break
+            self._save_calendar_ids()
+
+            return calendar_ids.get(calendar_name)
 
     @requires_google_auth
     def create_calendar(self, calendar_name: str) -> CalendarID:
@@ -74,55 +215,265 @@ class GoogleCalendarServiceConnector(ServiceConnector):
             "summary": calendar_name,
             "timeZone": "UTC"
         }
-        return self.api.calendars().insert(body=new_calendar).execute()["id"]
+        calendar_id = self.call_with_retry(self.api.calendars().insert(body=new_calendar).execute)["id"]
+        with self.cache_lock:
+            self._get_calendar_ids()[calendar_name] = calendar_id
+            self._save_calendar_ids()
+        return calendar_id
+
+    def _get_calendar_ids(self) -> Dict[str, CalendarID]:
+        """Return the cached calendar name to ID mapping, loading it from disk on first use."""
+        if self.calendar_ids is None:
+            self.calendar_ids = {}
+            calendar_ids_file_path = self.get_data_file_path("calendar_ids.json")
+            if os.path.exists(calendar_ids_file_path):
+                try:
+                    with open(calendar_ids_file_path, "r", encoding="utf-8") as calendar_ids_file:
+                        self.calendar_ids = json.load(calendar_ids_file)
+                except ValueError:
+                    # The IDs are only a cache, an unreadable file is rebuilt by listing the calendars again.
+                    self.logger.warning("Ignoring unreadable {0}, listing calendars again.".format(calendar_ids_file_path))
+        return self.calendar_ids
+
+    def _save_calendar_ids(self):
+        write_file_atomically(self.get_data_file_path("calendar_ids.json"), [json.dumps(self.calendar_ids).encode("utf-8")])
+
+    def _forget_calendar(self, calendar_id: CalendarID):
+        """Remove all cached data for a calendar that no longer exists."""
+        with self.cache_lock:
+            calendar_ids = self._get_calendar_ids()
+            for calendar_name in [name for name, cached_id in calendar_ids.items() if cached_id == calendar_id]:
+                del calendar_ids[calendar_name]
+            self._save_calendar_ids()
+
+            self.remote_snapshots.pop(calendar_id, None)
+        snapshot_file_path = self._get_snapshot_file_path(calendar_id)
+        if os.path.exists(snapshot_file_path):
+            os.remove(snapshot_file_path)
 
     @requires_google_auth
     def create_event(self, calendar_id: CalendarID, addon_event: AddonEvent):
-        start_datetime = datetime.fromtimestamp(addon_event["startTime"], tz=pytz.utc)
-        end_datetime = datetime.fromtimestamp(addon_event["endTime"], tz=pytz.utc)
-
-        event_data = {
-            "id": addon_event["eventID"],
-            "summary": addon_event["title"],
-            "description": "{0} {1} {2}".format(addon_event["description"], CREATED_BY_STRING, addon_event["creator"]),
-            "start": {
-                "dateTime": start_datetime.isoformat(),
-                "timeZone": "UTC"
-            },
-            "end": {
-                "dateTime": end_datetime.isoformat(),
-                "timeZone": "UTC"
-            }
-        }
-        self.api.events().insert(calendarId=calendar_id, body=event_data).execute()
+        self.call_with_retry(self._create_event_request(calendar_id, addon_event).execute)
 
     @requires_google_auth
     def remove_event(self, calendar_id: CalendarID, remote_event: RemoteEvent):
-        self.api.events().delete(calendarId=calendar_id, eventId=remote_event["id"]).execute()
+        self.call_with_retry(self._remove_event_request(calendar_id, remote_event).execute)
 
     @requires_google_auth
     def update_event(self, calendar_id: CalendarID, remote_event: RemoteEvent, addon_event: AddonEvent):
-        event_data = {
-            "summary": addon_event["title"],
-            "description": "{0} {1} {2}".format(addon_event["description"], CREATED_BY_STRING, addon_event["creator"]),
-        }
-        self.api.events().patch(calendarId=calendar_id, eventId=remote_event["id"], body=event_data).execute()
+        self.call_with_retry(self._update_event_request(calendar_id, remote_event, addon_event).execute)
+
+    @requires_google_auth
+    def apply_changes(self, calendar_id: CalendarID, creates: Sequence[AddonEvent],
+                      updates: Sequence[Tuple[RemoteEvent, AddonEvent]], deletes: Sequence[RemoteEvent]) -> List[FailedChange]:
+        from googleapiclient.errors import HttpError
+
+        # Requests are rebuilt for each attempt, so changes rate limited within a batch can be retried in a later one.
+        changes = []
+        changes.extend((ChangeOperation.CREATE, addon_event, partial(self._create_event_request, calendar_id, addon_event))
+                       for addon_event in creates)
+        changes.extend((ChangeOperation.UPDATE, (remote_event, addon_event), partial(self._update_event_request, calendar_id, remote_event, addon_event))
+                       for remote_event, addon_event in updates)
+        changes.extend((ChangeOperation.DELETE, remote_event, partial(self._remove_event_request, calendar_id, remote_event))
+                       for remote_event in deletes)
+
+        failed_changes = []
+        attempt = 0
+        while changes:
+            rate_limited_changes = []
+            retry_after = None
+            for chunk_start in range(0, len(changes), MAX_BATCH_SIZE):
+                chunk = changes[chunk_start:chunk_start + MAX_BATCH_SIZE]
+
+                def on_response(request_id, response, exception, chunk=chunk):
+                    nonlocal retry_after
+                    if exception is None:
+                        return
+                    change = chunk[int(request_id)]
+                    if attempt < self.retry_policy.max_retries and self.is_rate_limit_error(exception):
+                        rate_limited_changes.append(change)
+                        retry_after = max(retry_after or 0, self.get_retry_after(exception) or 0)
+                    else:
+                        operation, event, _ = change
+                        failed_changes.append(FailedChange(operation, event, exception))
+
+                def execute_batch(chunk=chunk, on_response=on_response):
+                    batch = self.api.new_batch_http_request(callback=on_response)
+                    for index, (_, _, build_request) in enumerate(chunk):
+                        batch.add(build_request(), request_id=str(index))
+                    batch.execute()
+
+                try:
+                    # Each request in a batch counts towards the quota.
+                    self.call_with_retry(execute_batch, cost=len(chunk))
+                except HttpError as e:
+                    # The whole batch request failed, so none of its changes were applied.
+                    failed_changes.extend(FailedChange(operation, event, e) for operation, event, _ in chunk)
+
+            if rate_limited_changes:
+                delay = self.retry_policy.get_delay(attempt, retry_after or None)
+                self.logger.warning("{0} changes rate limited, retrying in {1:.1f}s.".format(len(rate_limited_changes), delay))
+                time.sleep(delay)
+                attempt += 1
+                with self.stats_lock:
+                    self.retry_count += len(rate_limited_changes)
+            changes = rate_limited_changes
+
+        return failed_changes
+
+    def _create_event_request(self, calendar_id: CalendarID, addon_event: AddonEvent):
+        event_data = _get_event_data(addon_event, SYNCED_FIELDS)
+        event_data["id"] = addon_event["eventID"]
+        return self.api.events().insert(calendarId=calendar_id, body=event_data)
+
+    def _remove_event_request(self, calendar_id: CalendarID, remote_event: RemoteEvent):
+        return self.api.events().delete(calendarId=calendar_id, eventId=remote_event["id"])
+
+    def _update_event_request(self, calendar_id: CalendarID, remote_event: RemoteEvent, addon_event: AddonEvent):
+        # Patch only what changed, unchanged fields are left as they are on the remote event.
+        event_data = _get_event_data(addon_event, self.get_changed_fields(addon_event, remote_event))
+        return self.api.events().patch(calendarId=calendar_id, eventId=remote_event["id"], body=event_data)
 
     @requires_google_auth
     def get_event(self, calendar_id: CalendarID, addon_event: AddonEvent) -> RemoteEvent or None:
+        from googleapiclient.errors import HttpError
+
         try:
-            return self.api.events().get(calendarId=calendar_id, eventId=addon_event["eventID"]).execute()
+            return self.call_with_retry(self.api.events().get(calendarId=calendar_id, eventId=addon_event["eventID"]).execute)
         except HttpError:
             return None
 
     @requires_google_auth
-    def get_events(self, calendar_id: CalendarID, lookahead_days: int) -> Sequence[RemoteEvent]:
-        now = datetime.utcnow().isoformat() + "Z"
-        events = self.api.events().list(calendarId=calendar_id, timeMin=now,
-                                        # Assume max of 10 events a day for results
-                                        maxResults=lookahead_days * 10, singleEvents=True,
-                                        orderBy="startTime").execute()
-        return events.get("items")
+    def get_existing_events(self, calendar_id: CalendarID) -> Dict[str, RemoteEvent]:
+        # Deleted events keep their IDs on Google Calendar, so the snapshot includes cancelled events.
+        if calendar_id not in self.remote_snapshots:
+            for _ in self._iter_remote_snapshot(calendar_id):
+                pass
+        return self.remote_snapshots[calendar_id]["events"]
+
+    @requires_google_auth
+    def get_events(self, calendar_id: CalendarID, lookahead_days: int) -> Iterator[RemoteEvent]:
+        now = datetime.now(tz=pytz.utc)
+        for event in self._iter_remote_snapshot(calendar_id):
+            if event.get("status") != "cancelled" and _parse_event_time(event["end"]) > now:
+                yield event
+
+    def _get_snapshot_file_path(self, calendar_id: CalendarID) -> str:
+        return self.get_data_file_path("snapshot_{0}.json".format(re.sub(r"[^\w.@-]", "_", calendar_id)))
+
+    def _iter_remote_snapshot(self, calendar_id: CalendarID) -> Iterator[RemoteEvent]:
+        """Bring the local snapshot of every event on the calendar up to date, yielding each event in it.
+        Only changes since the last sync are fetched if a sync token is available,
+        otherwise the whole calendar is listed and events are yielded as each page arrives.
+        """
+        from googleapiclient.errors import HttpError
+
+        snapshot = self.remote_snapshots.get(calendar_id)
+        snapshot_file_path = self._get_snapshot_file_path(calendar_id)
+        if snapshot is None and os.path.exists(snapshot_file_path):
+            try:
+                with open(snapshot_file_path, "r", encoding="utf-8") as snapshot_file:
+                    snapshot = json.load(snapshot_file)
+            except ValueError:
+                # Treat an unreadable snapshot as missing, the full listing below replaces it.
+                self.logger.warning("Ignoring unreadable snapshot {0}, relisting all events.".format(snapshot_file_path))
+
+        if snapshot is not None and snapshot.get("sync_token"):
+            try:
+                for page in self._iter_event_pages(calendar_id, syncToken=snapshot["sync_token"]):
+                    for event in page.get("items", []):
+                        snapshot["events"][self.get_remote_event_key(event)] = event
+                    snapshot["sync_token"] = page.get("nextSyncToken")
+            except HttpError as e:
+                if e.resp.status != 410:
+                    raise
+                # Sync token has expired or been invalidated, a full listing is required.
+                self.logger.info("Sync token for {0} rejected, relisting all events.".format(calendar_id))
+            else:
+                self._save_remote_snapshot(calendar_id, snapshot)
+                yield from snapshot["events"].values()
+                return
+
+        snapshot = {"sync_token": None, "events": {}}
+        for page in self._iter_event_pages(calendar_id):
+            for event in page.get("items", []):
+                snapshot["events"][self.get_remote_event_key(event)] = event
+                yield event
+            snapshot["sync_token"] = page.get("nextSyncToken")
+        self._save_remote_snapshot(calendar_id, snapshot)
+
+    def _save_remote_snapshot(self, calendar_id: CalendarID, snapshot):
+        # Snapshots are only written by the thread syncing their calendar.
+        self.remote_snapshots[calendar_id] = snapshot
+        write_file_atomically(self._get_snapshot_file_path(calendar_id), [json.dumps(snapshot).encode("utf-8")])
+
+    def _iter_event_pages(self, calendar_id: CalendarID, **list_args) -> Iterator[Mapping[str, Any]]:
+        """Yield each page of events listed with the specified arguments, only requesting a page once the previous
+        one has been consumed. The last page contains the nextSyncToken."""
+        from googleapiclient.errors import HttpError
+
+        page_token = None
+        while True:
+            try:
+                page = self.call_with_retry(self.api.events().list(
+                    calendarId=calendar_id, showDeleted=True, singleEvents=True,
+                    maxResults=self.page_size, pageToken=page_token, **list_args).execute)
+            except HttpError as e:
+                if e.resp.status == 404:
+                    self._forget_calendar(calendar_id)
+                    raise CalendarNotFoundError(calendar_id) from e
+                raise
+            yield page
+            page_token = page.get("nextPageToken")
+            if not page_token:
+                return
+
+    def is_change_already_applied(self, operation: ChangeOperation, error: Exception) -> bool:
+        from googleapiclient.errors import HttpError
+
+        if not isinstance(error, HttpError):
+            return False
+        if operation is ChangeOperation.CREATE:
+            # Event IDs are chosen by the client, so a duplicate ID means the insert has already gone through.
+            return error.resp.status == 409
+        if operation is ChangeOperation.DELETE:
+            return error.resp.status in (404, 410)
+        return False
+
+    def is_rate_limit_error(self, error: Exception) -> bool:
+        from googleapiclient.errors import HttpError
+
+        if not isinstance(error, HttpError):
+            return False
+        if error.resp.status in RETRYABLE_STATUSES:
+            return True
+        if error.resp.status == 403:
+            try:
+                reasons = {detail.get("reason") for detail in json.loads(error.content)["error"]["errors"]}
+            except (ValueError, KeyError, TypeError, AttributeError):
+                return False
+            return not reasons.isdisjoint(RATE_LIMIT_REASONS)
+        return False
+
+    def get_retry_after(self, error: Exception) -> float or None:
+        from googleapiclient.errors import HttpError
+
+        if not isinstance(error, HttpError):
+            return None
+        retry_after = error.resp.get("retry-after")
+        if retry_after is None:
+            return None
+        try:
+            return float(retry_after)
+        except ValueError:
+            # Retry-After can also be an HTTP date.
+            try:
+                return max(0.0, (parsedate_to_datetime(retry_after) - datetime.now(tz=pytz.utc)).total_seconds())
+            except (TypeError, ValueError):
+                return None
+
+    def get_remote_event_key(self, remote_event: RemoteEvent) -> str:
+        return remote_event["id"].strip()
 
     def compare_events(self, addon_event: AddonEvent, remote_event: RemoteEvent) -> EventComparisonResult:
         # Note: if an event is deleted on the remote, we won't be able to recreate it as IDs aren't released.
@@ -130,17 +481,65 @@ class GoogleCalendarServiceConnector(ServiceConnector):
         # The alternative is to compare times and titles, which allows reuse but is messier and
         # may result in incorrect results when updating or removing events.
         if addon_event["eventID"].strip() == remote_event["id"].strip():
-            if addon_event["description"].strip() == remote_event["description"].split(CREATED_BY_STRING)[0].strip() \
-                    and addon_event["title"].strip() == remote_event["summary"].strip():
+            if not self.get_changed_fields(addon_event, remote_event):
                 return EventComparisonResult.EQUAL
             else:
                 return EventComparisonResult.UPDATED
 
         return EventComparisonResult.DIFFERENT
 
+    def get_changed_fields(self, addon_event: AddonEvent, remote_event: RemoteEvent) -> Set[str]:
+        description, _, creator = remote_event.get("description", "").partition(CREATED_BY_STRING)
+        remote_values = {
+            "title": remote_event.get("summary", "").strip(),
+            "description": description.strip(),
+            "creator": creator.strip(),
+            "startTime": _parse_event_time(remote_event["start"]),
+            "endTime": _parse_event_time(remote_event["end"]),
+        }
+        addon_values = {
+            "title": addon_event["title"].strip(),
+            "description": addon_event["description"].strip(),
+            "creator": addon_event["creator"].strip(),
+            "startTime": datetime.fromtimestamp(addon_event["startTime"], tz=pytz.utc),
+            "endTime": datetime.fromtimestamp(addon_event["endTime"], tz=pytz.utc),
+        }
+        return {field for field in SYNCED_FIELDS if addon_values[field] != remote_values[field]}
+
+    def get_request_count(self, change_count: int) -> int:
+        return -(-change_count // MAX_BATCH_SIZE)
+
     def event_tostring(self, remote_event: RemoteEvent) -> str:
         return "{0} - {1}".format(remote_event["summary"], remote_event["start"]["dateTime"])
 
 
+def _get_event_data(addon_event: AddonEvent, fields: Collection[str]) -> Dict[str, Any]:
+    """Return the Calendar API event resource fields representing the specified addon event fields."""
+    event_data = {}
+    if "title" in fields:
+        event_data["summary"] = addon_event["title"]
+    # The creator is stored at the end of the description, so both are sent if either changes.
+    if "description" in fields or "creator" in fields:
+        event_data["description"] = "{0} {1} {2}".format(addon_event["description"], CREATED_BY_STRING, addon_event["creator"])
+    if "startTime" in fields:
+        event_data["start"] = {
+            "dateTime": datetime.fromtimestamp(addon_event["startTime"], tz=pytz.utc).isoformat(),
+            "timeZone": "UTC"
+        }
+    if "endTime" in fields:
+        event_data["end"] = {
+            "dateTime": datetime.fromtimestamp(addon_event["endTime"], tz=pytz.utc).isoformat(),
+            "timeZone": "UTC"
+        }
+    return event_data
+
+
+def _parse_event_time(event_time) -> datetime:
+    """Return the datetime of an event's start or end, treating all-day events as starting at midnight UTC."""
+    if "dateTime" in event_time:
+        return pyrfc3339.parse(event_time["dateTime"])
+    return pyrfc3339.parse(event_time["date"] + "T00:00:00Z")
+
+
 def get_connector(config) -> ServiceConnector:
     return GoogleCalendarServiceConnector(config)
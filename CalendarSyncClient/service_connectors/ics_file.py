@@ -0,0 +1,431 @@
+import calendar
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Mapping, Sequence, Set, Tuple
+
+from . import ServiceConnector, AddonEvent, CalendarID, CalendarNotFoundError, ChangeOperation, EventComparisonResult, FailedChange, \
+    RemoteEvent, SYNCED_FIELDS, write_file_atomically
+
+# Each calendar is written to <OutputFolder>/<calendar ID>.ics, with the calendar ID made from the calendar name.
+FILE_EXTENSION = ".ics"
+# Hex digits of the calendar name's hash added to each calendar ID.
+CALENDAR_ID_HASH_LENGTH = 8
+HEADER = "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//WoWCalendarSync//CalendarSync Client//EN\r\nCALSCALE:GREGORIAN\r\n"
+FOOTER = b"END:VCALENDAR\r\n"
+EVENT_BEGIN = b"BEGIN:VEVENT\r\n"
+EVENT_END = b"END:VEVENT\r\n"
+UID_SUFFIX = "@wowcalendarsync"
+# Custom addition to append to the description as iCalendar has no field for an arbitrary creator string.
+CREATED_BY_STRING = "\n\n~ Created by"
+# Lines longer than this many bytes are folded onto continuation lines starting with a space.
+MAX_LINE_LENGTH = 75
+ICS_TIME_FORMAT = "%Y%m%dT%H%M%SZ"
+TEXT_ESCAPES = {"\\": "\\\\", ";": "\\;", ",": "\\,", "\n": "\\n"}
+
+
+class IcsConflictError(Exception):
+    """Raised when creating an event with an ID that's already in the file."""
+    pass
+
+
+class IcsNotFoundError(Exception):
+    """Raised when changing an event that isn't in the file."""
+    pass
+
+
+class IcsFileIndex(object):
+    """Where each VEVENT is in a calendar's .ics file, along with the synced fields of the event.
+
+    The file is a header, each event's VEVENT in the order they were created, then FOOTER.
+    The index records the size and modification time of the file it was made for, so it's rebuilt from the file
+    if the file is changed by anything else, or a write is interrupted between replacing the file and the index.
+    """
+
+    def __init__(self, file_size: int, file_mtime_ns: int, header_length: int,
+                 spans: Dict[str, Tuple[int, int]], events: Dict[str, RemoteEvent]):
+        self.file_size = file_size
+        self.file_mtime_ns = file_mtime_ns
+        self.header_length = header_length
+        # Event key: (offset, length) of the event's VEVENT, including its BEGIN and END lines.
+        self.spans = spans
+        # Event key: event.
+        self.events = events
+
+    @property
+    def events_end(self) -> int:
+        return self.file_size - len(FOOTER)
+
+    def to_json(self) -> Mapping[str, Any]:
+        return {
+            "file_size": self.file_size,
+            "file_mtime_ns": self.file_mtime_ns,
+            "header_length": self.header_length,
+            "spans": self.spans,
+            "events": self.events,
+        }
+
+    @classmethod
+    def from_json(cls, index_json: Mapping[str, Any]) -> "IcsFileIndex":
+        return cls(index_json["file_size"], index_json["file_mtime_ns"], index_json["header_length"],
+                   {key: tuple(span) for key, span in index_json["spans"].items()}, index_json["events"])
+
+
+class IcsFileServiceConnector(ServiceConnector):
+    """Writes each calendar to a local .ics file, for calendar apps to subscribe to through a local web server.
+
+    Changes only serialise the events they add or update. The rest of the file is copied across unchanged using
+    the byte offsets in each calendar's IcsFileIndex, and the new file replaces the old one in a single rename so
+    readers never see a partly written file. Needs no account or network, so it can also be used to benchmark syncs.
+    """
+
+    # Each calendar's file and index are guarded by their own lock.
+    thread_safe = True
+
+    def __init__(self, config):
+        super().__init__(__file__, config)
+        self.output_path = self.get_config_option("OutputFolder")
+        self.calendar_locks = defaultdict(threading.Lock)
+        self.locks_lock = threading.Lock()
+        # Calendar ID: index of the calendar's file, loaded on first use.
+        self.indexes: Dict[CalendarID, IcsFileIndex] = {}
+        # Files written, and bytes of them copied from the previous version of the file or newly serialised.
+        self.file_writes = 0
+        self.bytes_copied = 0
+        self.bytes_serialised = 0
+
+    def _get_calendar_lock(self, calendar_id: CalendarID) -> threading.Lock:
+        with self.locks_lock:
+            return self.calendar_locks[calendar_id]
+
+    def _get_calendar_file_path(self, calendar_id: CalendarID) -> str:
+        return os.path.join(self.output_path, calendar_id + FILE_EXTENSION)
+
+    def _get_index_file_path(self, calendar_id: CalendarID) -> str:
+        return self.get_data_file_path("index_{0}.json".format(calendar_id))
+
+    def get_calender_id_by_name(self, calendar_name: str) -> CalendarID:
+        calendar_id = _get_calendar_id(calendar_name)
+        if not os.path.exists(self._get_calendar_file_path(calendar_id)):
+            return None
+        return calendar_id
+
+    def create_calendar(self, calendar_name: str) -> CalendarID:
+        calendar_id = _get_calendar_id(calendar_name)
+        header = (HEADER + _format_property("X-WR-CALNAME", _escape_text(calendar_name))).encode("utf-8")
+        os.makedirs(self.output_path, exist_ok=True)
+        with self._get_calendar_lock(calendar_id):
+            self.indexes[calendar_id] = self._write_calendar_file(calendar_id, [header, FOOTER], len(header), {}, {})
+        return calendar_id
+
+    def create_event(self, calendar_id: CalendarID, addon_event: AddonEvent):
+        self._raise_failed_change(self.apply_changes(calendar_id, [addon_event], [], []))
+
+    def remove_event(self, calendar_id: CalendarID, remote_event: RemoteEvent):
+        self._raise_failed_change(self.apply_changes(calendar_id, [], [], [remote_event]))
+
+    def update_event(self, calendar_id: CalendarID, remote_event: RemoteEvent, addon_event: AddonEvent):
+        self._raise_failed_change(self.apply_changes(calendar_id, [], [(remote_event, addon_event)], []))
+
+    @staticmethod
+    def _raise_failed_change(failed_changes: List[FailedChange]):
+        if failed_changes:
+            raise failed_changes[0].error
+
+    def apply_changes(self, calendar_id: CalendarID, creates: Sequence[AddonEvent],
+                      updates: Sequence[Tuple[RemoteEvent, AddonEvent]], deletes: Sequence[RemoteEvent]) -> List[FailedChange]:
+        failed_changes = []
+        # Changes that will be made, as (operation, event) in the form used by FailedChange.
+        changes = []
+        with self._get_calendar_lock(calendar_id):
+            index = self._get_index(calendar_id)
+            # Event key: new VEVENT for updated events, or None for removed ones.
+            replaced_events: Dict[str, bytes or None] = {}
+            created_events: List[Tuple[str, bytes]] = []
+            changed_remote_events: Dict[str, RemoteEvent] = {}
+
+            for addon_event in creates:
+                key = self.get_addon_event_key(addon_event)
+                if key in index.events or key in changed_remote_events:
+                    failed_changes.append(FailedChange(ChangeOperation.CREATE, addon_event, IcsConflictError(key)))
+                    continue
+                changed_remote_events[key] = _get_remote_event(key, addon_event, 0)
+                created_events.append((key, _serialise_event(changed_remote_events[key])))
+                changes.append((ChangeOperation.CREATE, addon_event))
+
+            for remote_event, addon_event in updates:
+                key = self.get_remote_event_key(remote_event)
+                if key not in index.events or key in replaced_events:
+                    failed_changes.append(FailedChange(ChangeOperation.UPDATE, (remote_event, addon_event), IcsNotFoundError(key)))
+                    continue
+                # Calendar apps only replace their copy of an event when its sequence number increases.
+                changed_remote_events[key] = _get_remote_event(key, addon_event, index.events[key]["sequence"] + 1)
+                replaced_events[key] = _serialise_event(changed_remote_events[key])
+                changes.append((ChangeOperation.UPDATE, (remote_event, addon_event)))
+
+            for remote_event in deletes:
+                key = self.get_remote_event_key(remote_event)
+                if key not in index.events or key in replaced_events:
+                    failed_changes.append(FailedChange(ChangeOperation.DELETE, remote_event, IcsNotFoundError(key)))
+                    continue
+                replaced_events[key] = None
+                changes.append((ChangeOperation.DELETE, remote_event))
+
+            if changes:
+                try:
+                    self._rewrite_calendar_file(calendar_id, index, replaced_events, created_events, changed_remote_events)
+                except OSError as e:
+                    # The file is only replaced once it's completely written, so none of the changes were made.
+                    failed_changes.extend(FailedChange(operation, event, e) for operation, event in changes)
+        return failed_changes
+
+    def _rewrite_calendar_file(self, calendar_id: CalendarID, index: IcsFileIndex, replaced_events: Mapping[str, bytes or None],
+                               created_events: Sequence[Tuple[str, bytes]], changed_remote_events: Mapping[str, RemoteEvent]):
+        """Write a new version of the calendar's file, copying each run of unchanged events across as a single block."""
+        # Chunks copied from the old file are memoryviews, so they're counted separately from serialised events.
+        with open(self._get_calendar_file_path(calendar_id), "rb") as calendar_file:
+            old_file = memoryview(calendar_file.read())
+
+        chunks = []
+        spans = {}
+        # Offset in the old file of the next byte to copy, and how far later events move in the new file.
+        copy_start = 0
+        offset_change = 0
+        for key, (offset, length) in sorted(index.spans.items(), key=lambda span: span[1][0]):
+            if key not in replaced_events:
+                spans[key] = (offset + offset_change, length)
+                continue
+            chunks.append(old_file[copy_start:offset])
+            copy_start = offset + length
+            new_event = replaced_events[key]
+            if new_event is None:
+                offset_change -= length
+            else:
+                chunks.append(new_event)
+                spans[key] = (offset + offset_change, len(new_event))
+                offset_change += len(new_event) - length
+        chunks.append(old_file[copy_start:index.events_end])
+
+        # New events go at the end, keeping the rest of the file in place.
+        offset = index.events_end + offset_change
+        for key, new_event in created_events:
+            chunks.append(new_event)
+            spans[key] = (offset, len(new_event))
+            offset += len(new_event)
+        chunks.append(FOOTER)
+
+        events = dict(index.events)
+        events.update(changed_remote_events)
+        for key, new_event in replaced_events.items():
+            if new_event is None:
+                del events[key]
+        self.indexes[calendar_id] = self._write_calendar_file(calendar_id, chunks, index.header_length, spans, events)
+
+    def _write_calendar_file(self, calendar_id: CalendarID, chunks: Sequence[bytes], header_length: int,
+                             spans: Dict[str, Tuple[int, int]], events: Dict[str, RemoteEvent]) -> IcsFileIndex:
+        """Atomically replace the calendar's file with chunks, then save and return the index of the new file."""
+        calendar_file_path = self._get_calendar_file_path(calendar_id)
+        self.call_with_retry(lambda: write_file_atomically(calendar_file_path, chunks))
+        with self.stats_lock:
+            self.file_writes += 1
+            for chunk in chunks:
+                if isinstance(chunk, memoryview):
+                    self.bytes_copied += len(chunk)
+                else:
+                    self.bytes_serialised += len(chunk)
+        file_stat = os.stat(calendar_file_path)
+        index = IcsFileIndex(file_stat.st_size, file_stat.st_mtime_ns, header_length, spans, events)
+        index_json = json.dumps(index.to_json()).encode("utf-8")
+        write_file_atomically(self._get_index_file_path(calendar_id), [index_json])
+        return index
+
+    def _get_index(self, calendar_id: CalendarID) -> IcsFileIndex:
+        """Return the index of the calendar's file, rebuilding it if the file has changed since it was made."""
+        try:
+            file_stat = os.stat(self._get_calendar_file_path(calendar_id))
+        except FileNotFoundError as e:
+            self.indexes.pop(calendar_id, None)
+            raise CalendarNotFoundError(calendar_id) from e
+        index = self.indexes.get(calendar_id)
+        if index is None:
+            index_file_path = self._get_index_file_path(calendar_id)
+            if os.path.exists(index_file_path):
+                with open(index_file_path, "r", encoding="utf-8") as index_file:
+                    index = IcsFileIndex.from_json(json.load(index_file))
+
+        if index is None or (index.file_size, index.file_mtime_ns) != (file_stat.st_size, file_stat.st_mtime_ns):
+            self.logger.info("Indexing {0}.".format(self._get_calendar_file_path(calendar_id)))
+            with open(self._get_calendar_file_path(calendar_id), "rb") as calendar_file:
+                index = _index_calendar_file(calendar_file.read(), file_stat)
+        self.indexes[calendar_id] = index
+        return index
+
+    def is_change_already_applied(self, operation: ChangeOperation, error: Exception) -> bool:
+        return (operation is ChangeOperation.CREATE and isinstance(error, IcsConflictError)) or \
+               (operation is ChangeOperation.DELETE and isinstance(error, IcsNotFoundError))
+
+    def is_rate_limit_error(self, error: Exception) -> bool:
+        # On Windows, replacing a file fails while another program, such as a web server, has it open.
+        return isinstance(error, PermissionError)
+
+    def get_request_count(self, change_count: int) -> int:
+        # Every change in apply_changes is made in a single write.
+        return min(change_count, 1)
+
+    def get_transport_stats(self) -> Mapping[str, int] or None:
+        with self.stats_lock:
+            return {
+                "file writes": self.file_writes,
+                "bytes copied": self.bytes_copied,
+                "bytes serialised": self.bytes_serialised,
+            }
+
+    def get_event(self, calendar_id: CalendarID, addon_event: AddonEvent) -> RemoteEvent or None:
+        with self._get_calendar_lock(calendar_id):
+            event = self._get_index(calendar_id).events.get(self.get_addon_event_key(addon_event))
+        return dict(event) if event is not None else None
+
+    def get_existing_events(self, calendar_id: CalendarID) -> Mapping[str, RemoteEvent]:
+        with self._get_calendar_lock(calendar_id):
+            return {key: dict(event) for key, event in self._get_index(calendar_id).events.items()}
+
+    def get_events(self, calendar_id: CalendarID, lookahead_days: int) -> Iterator[RemoteEvent]:
+        # Like Google Calendar, every upcoming event is returned as the addon decides what's in the lookahead window.
+        now = time.time()
+        with self._get_calendar_lock(calendar_id):
+            events = list(self._get_index(calendar_id).events.values())
+        for event in events:
+            if event["endTime"] > now:
+                yield dict(event)
+
+    def get_remote_event_key(self, remote_event: RemoteEvent) -> str:
+        return remote_event["id"].strip()
+
+    def compare_events(self, addon_event: AddonEvent, remote_event: RemoteEvent) -> EventComparisonResult:
+        if self.get_addon_event_key(addon_event) != self.get_remote_event_key(remote_event):
+            return EventComparisonResult.DIFFERENT
+        if self.get_changed_fields(addon_event, remote_event):
+            return EventComparisonResult.UPDATED
+        return EventComparisonResult.EQUAL
+
+    def get_changed_fields(self, addon_event: AddonEvent, remote_event: RemoteEvent) -> Set[str]:
+        addon_values = _get_remote_event(remote_event["id"], addon_event, remote_event["sequence"])
+        return {field for field in SYNCED_FIELDS if addon_values[field] != remote_event[field]}
+
+    def event_tostring(self, remote_event: RemoteEvent) -> str:
+        return "{0} - {1}".format(remote_event["title"], time.strftime(ICS_TIME_FORMAT, time.gmtime(remote_event["startTime"])))
+
+
+def _get_calendar_id(calendar_name: str) -> CalendarID:
+    """Return the calendar's ID, which is also the name of its file.
+    Names that only differ in characters that can't be used in file names, or in case, get different IDs from the hash."""
+    name_hash = hashlib.sha256(calendar_name.encode("utf-8")).hexdigest()[:CALENDAR_ID_HASH_LENGTH]
+    return "{0}_{1}".format(re.sub(r"[^\w.-]", "_", calendar_name), name_hash)
+
+
+def _get_remote_event(key: str, addon_event: AddonEvent, sequence: int) -> RemoteEvent:
+    """Return the event as it's stored in the file. Text is stripped, as surrounding whitespace isn't kept."""
+    return {
+        "id": key,
+        "sequence": sequence,
+        "title": addon_event["title"].strip(),
+        "description": addon_event.get("description", "").strip(),
+        "creator": addon_event.get("creator", "").strip(),
+        "startTime": int(addon_event["startTime"]),
+        "endTime": int(addon_event["endTime"]),
+    }
+
+
+def _serialise_event(remote_event: RemoteEvent) -> bytes:
+    description = remote_event["description"]
+    if remote_event["creator"]:
+        description = "{0}{1} {2}".format(description, CREATED_BY_STRING, remote_event["creator"])
+    return EVENT_BEGIN + "".join((
+        _format_property("UID", remote_event["id"] + UID_SUFFIX),
+        _format_property("DTSTAMP", time.strftime(ICS_TIME_FORMAT, time.gmtime())),
+        _format_property("SEQUENCE", str(remote_event["sequence"])),
+        _format_property("DTSTART", time.strftime(ICS_TIME_FORMAT, time.gmtime(remote_event["startTime"]))),
+        _format_property("DTEND", time.strftime(ICS_TIME_FORMAT, time.gmtime(remote_event["endTime"]))),
+        _format_property("SUMMARY", _escape_text(remote_event["title"])),
+        _format_property("DESCRIPTION", _escape_text(description)),
+    )).encode("utf-8") + EVENT_END
+
+
+def _format_property(name: str, value: str) -> str:
+    line = "{0}:{1}".format(name, value).encode("utf-8")
+    if len(line) <= MAX_LINE_LENGTH:
+        return line.decode("utf-8") + "\r\n"
+    # Lines are folded by byte length, without splitting multi-byte characters across lines.
+    folded_lines = []
+    line_start = 0
+    while line_start < len(line):
+        line_end = min(line_start + MAX_LINE_LENGTH - (1 if folded_lines else 0), len(line))
+        while line_end < len(line) and line[line_end] & 0xC0 == 0x80:
+            line_end -= 1
+        folded_lines.append(line[line_start:line_end].decode("utf-8"))
+        line_start = line_end
+    return "\r\n ".join(folded_lines) + "\r\n"
+
+
+def _escape_text(text: str) -> str:
+    return re.sub(r"[\\;,\n]", lambda match: TEXT_ESCAPES[match.group(0)], text.replace("\r\n", "\n"))
+
+
+def _unescape_text(text: str) -> str:
+    return re.sub(r"\\(.)", lambda match: "\n" if match.group(1) in "nN" else match.group(1), text)
+
+
+def _parse_ics_time(value: str) -> int:
+    # Events are written in UTC, dates without a time are treated as starting at midnight UTC.
+    if "T" not in value:
+        value += "T000000Z"
+    return calendar.timegm(time.strptime(value.rstrip("Z"), ICS_TIME_FORMAT.rstrip("Z")))
+
+
+def _parse_event(vevent: bytes) -> RemoteEvent:
+    """Return the event for a VEVENT written by _serialise_event."""
+    properties = {}
+    for line in vevent.replace(b"\r\n ", b"").replace(b"\r\n\t", b"").decode("utf-8").split("\r\n"):
+        name, _, value = line.partition(":")
+        properties.setdefault(name.split(";")[0].upper(), value)
+
+    uid = properties["UID"]
+    description, _, creator = _unescape_text(properties.get("DESCRIPTION", "")).partition(CREATED_BY_STRING)
+    return {
+        "id": uid[:-len(UID_SUFFIX)] if uid.endswith(UID_SUFFIX) else uid,
+        "sequence": int(properties.get("SEQUENCE", 0)),
+        "title": _unescape_text(properties.get("SUMMARY", "")).strip(),
+        "description": description.strip(),
+        "creator": creator.strip(),
+        "startTime": _parse_ics_time(properties["DTSTART"]),
+        "endTime": _parse_ics_time(properties.get("DTEND", properties["DTSTART"])),
+    }
+
+
+def _index_calendar_file(data: bytes, file_stat: os.stat_result) -> IcsFileIndex:
+    """Index every VEVENT in the file, for when the saved index doesn't match it."""
+    if not data.endswith(FOOTER):
+        raise ValueError("Calendar file doesn't end with {0}".format(FOOTER.decode("utf-8").strip()))
+    spans = {}
+    events = {}
+    header_length = None
+    offset = data.find(EVENT_BEGIN)
+    while offset != -1:
+        end = data.index(EVENT_END, offset) + len(EVENT_END)
+        event = _parse_event(data[offset + len(EVENT_BEGIN):end - len(EVENT_END)])
+        spans[event["id"]] = (offset, end - offset)
+        events[event["id"]] = event
+        if header_length is None:
+            header_length = offset
+        offset = data.find(EVENT_BEGIN, end)
+    if header_length is None:
+        header_length = len(data) - len(FOOTER)
+    return IcsFileIndex(file_stat.st_size, file_stat.st_mtime_ns, header_length, spans, events)
+
+
+def get_connector(config) -> ServiceConnector:
+    return IcsFileServiceConnector(config)
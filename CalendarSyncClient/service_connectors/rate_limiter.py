@@ -0,0 +1,48 @@
+import random
+import threading
+import time
+
+
+class TokenBucket(object):
+    """Thread safe token bucket limiting requests to rate per second, with bursts of up to capacity requests.
+    A rate of None disables limiting.
+    """
+
+    def __init__(self, rate: float or None, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate or 1, 1)
+        self._tokens = self.capacity
+        self._last_refill_time = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1):
+        """Block until tokens are available, then consume them.
+        Tokens are reserved up front, so concurrent callers are served in the order they arrive."""
+        if not self.rate:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last_refill_time) * self.rate)
+            self._last_refill_time = now
+            self._tokens -= tokens
+            wait_time = -self._tokens / self.rate if self._tokens < 0 else 0
+
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+class RetryPolicy(object):
+    """Exponential backoff with full jitter, honouring any delay requested by the service."""
+
+    def __init__(self, max_retries: int, base_delay: float = 1, max_delay: float = 64):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def get_delay(self, attempt: int, retry_after: float = None) -> float:
+        """Return the seconds to wait before retry number attempt, starting at 0."""
+        backoff_delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after is not None:
+            return max(retry_after, backoff_delay)
+        return backoff_delay
@@ -0,0 +1,214 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, FrozenSet, Iterable, Iterator, List, Mapping, NamedTuple, Set, Tuple
+
+from service_connectors import AddonEvent, CalendarID, ChangeOperation
+
+SCHEMA_VERSION = 2
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS calendars (
+    service TEXT NOT NULL,
+    calendar_id TEXT NOT NULL,
+    seeded INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (service, calendar_id)
+);
+CREATE TABLE IF NOT EXISTS events (
+    service TEXT NOT NULL,
+    calendar_id TEXT NOT NULL,
+    remote_id TEXT NOT NULL,
+    addon_event_id TEXT,
+    content_hash TEXT,
+    last_synced REAL,
+    PRIMARY KEY (service, calendar_id, remote_id)
+);
+CREATE UNIQUE INDEX IF NOT EXISTS events_by_addon_event_id ON events (service, calendar_id, addon_event_id);
+CREATE TABLE IF NOT EXISTS outbox (
+    change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    service TEXT NOT NULL,
+    calendar_id TEXT NOT NULL,
+    operation INTEGER NOT NULL,
+    change TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_by_calendar ON outbox (service, calendar_id);
+"""
+
+
+class PendingChange(NamedTuple):
+    """A change to a remote calendar, recorded in the outbox before it's applied.
+    key is the remote event key the change applies to and event is as described by FailedChange.
+    synced_event is the (addon event key, content hash) to record once a create or update has been applied.
+    changed_fields is the SYNCED_FIELDS an update changes.
+    Events must be JSON serialisable.
+    """
+    operation: ChangeOperation
+    key: str
+    event: Any
+    synced_event: Tuple[str, str] or None = None
+    changed_fields: FrozenSet[str] = frozenset()
+    change_id: int or None = None
+
+
+def hash_addon_event(addon_event: AddonEvent) -> str:
+    """Return a hash of the synced content of an addon event.
+    The event ID is left out as it's replaced with a sub-ID when the original ID is already in use."""
+    content = {key: value for key, value in addon_event.items() if key != "eventID"}
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class StateStore(object):
+    """SQLite database recording which remote event each addon event was synced to, and what was synced.
+
+    Every remote event ID known to be in use on a calendar is kept, even once its addon event is gone,
+    as services may not release the IDs of deleted events.
+    Safe to share between threads, each call runs in its own transaction.
+    """
+
+    def __init__(self, db_path: str):
+        Path(os.path.dirname(db_path) or ".").mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+            self._connection.execute("PRAGMA user_version={0}".format(SCHEMA_VERSION))
+
+    def get_calendar_state(self, service_name: str, calendar_id: CalendarID) -> "CalendarState":
+        return CalendarState(self, service_name, str(calendar_id))
+
+    def execute(self, sql: str, parameters: Iterable = ()) -> list:
+        """Run a single statement in its own transaction, returning any rows it selects."""
+        with self._lock, self._connection:
+            return self._connection.execute(sql, tuple(parameters)).fetchall()
+
+    def execute_many(self, statements: Iterable[Tuple[str, Iterable]]):
+        """Run a sequence of (sql, parameters) statements in a single transaction."""
+        with self.transaction() as connection:
+            for sql, parameters in statements:
+                connection.execute(sql, tuple(parameters))
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Hold the store for a transaction, committed if the block completes and rolled back if it raises."""
+        with self._lock, self._connection:
+            yield self._connection
+
+    def get_pending_calendar_states(self, service_name: str) -> List["CalendarState"]:
+        """Return the calendars on a service with changes left in the outbox by an interrupted sync."""
+        rows = self.execute("SELECT DISTINCT calendar_id FROM outbox WHERE service=?", (service_name,))
+        return [CalendarState(self, service_name, calendar_id) for calendar_id, in rows]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class CalendarState(object):
+    """The StateStore records for one calendar on one service. Event IDs are keys from the service connector."""
+
+    def __init__(self, store: StateStore, service_name: str, calendar_id: str):
+        self.store = store
+        self.service_name = service_name
+        self.calendar_id = calendar_id
+
+    def is_seeded(self) -> bool:
+        """Return whether every event ID in use on the remote calendar has been recorded,
+        so IDs missing from the store can be assumed to be free."""
+        rows = self.store.execute("SELECT seeded FROM calendars WHERE service=? AND calendar_id=?",
+                                  (self.service_name, self.calendar_id))
+        return bool(rows and rows[0][0])
+
+    def seed(self, remote_ids: Iterable[str]):
+        """Record every event ID in use on the remote calendar, marking the calendar as seeded."""
+        statements = [("INSERT OR IGNORE INTO events (service, calendar_id, remote_id) VALUES (?, ?, ?)",
+                       (self.service_name, self.calendar_id, remote_id)) for remote_id in remote_ids]
+        statements.append(("INSERT INTO calendars (service, calendar_id, seeded) VALUES (?, ?, 1) "
+                           "ON CONFLICT (service, calendar_id) DO UPDATE SET seeded=1",
+                           (self.service_name, self.calendar_id)))
+        self.store.execute_many(statements)
+
+    def get_mapping(self, addon_event_id: str) -> Tuple[str, str] or None:
+        """Return the (remote_id, content_hash) last synced for an addon event ID, or None if it hasn't been synced."""
+        rows = self.store.execute("SELECT remote_id, content_hash FROM events "
+                                  "WHERE service=? AND calendar_id=? AND addon_event_id=?",
+                                  (self.service_name, self.calendar_id, addon_event_id))
+        return rows[0] if rows else None
+
+    def is_remote_id_used(self, remote_id: str) -> bool:
+        return bool(self.store.execute("SELECT 1 FROM events WHERE service=? AND calendar_id=? AND remote_id=?",
+                                       (self.service_name, self.calendar_id, remote_id)))
+
+    def record_synced(self, synced_events: Mapping[str, Tuple[str, str]]):
+        """Record that the addon events have been synced, given as remote_id: (addon_event_id, content_hash)."""
+        self.store.execute_many(self._get_record_synced_statements(synced_events))
+
+    def add_pending_changes(self, changes: Iterable[PendingChange]) -> List[PendingChange]:
+        """Write the changes to the outbox before they're applied, returning them with their change IDs set."""
+        pending_changes = []
+        with self.store.transaction() as connection:
+            for change in changes:
+                cursor = connection.execute(
+                    "INSERT INTO outbox (service, calendar_id, operation, change) VALUES (?, ?, ?, ?)",
+                    (self.service_name, self.calendar_id, int(change.operation),
+                     json.dumps([change.key, change.event, change.synced_event, sorted(change.changed_fields)])))
+                pending_changes.append(change._replace(change_id=cursor.lastrowid))
+        return pending_changes
+
+    def get_pending_changes(self) -> List[PendingChange]:
+        """Return the changes in the outbox for this calendar, in the order they were added."""
+        pending_changes = []
+        for change_id, operation, change in self.store.execute(
+                "SELECT change_id, operation, change FROM outbox WHERE service=? AND calendar_id=? ORDER BY change_id",
+                (self.service_name, self.calendar_id)):
+            operation = ChangeOperation(operation)
+            key, event, synced_event, changed_fields = json.loads(change)
+            if operation is ChangeOperation.UPDATE:
+                event = tuple(event)
+            pending_changes.append(PendingChange(operation, key, event, tuple(synced_event) if synced_event else None,
+                                                 frozenset(changed_fields), change_id))
+        return pending_changes
+
+    def complete_pending_changes(self, pending_changes: Iterable[PendingChange], failed_keys: Set[Tuple[ChangeOperation, str]]):
+        """Remove changes from the outbox once they've been attempted, recording the ones that were applied.
+        failed_keys holds the (operation, key) of each change that failed, these are left for the next sync to redo."""
+        statements = []
+        synced_events = {}
+        released_ids = []
+        for change in pending_changes:
+            statements.append(("DELETE FROM outbox WHERE change_id=?", (change.change_id,)))
+            if (change.operation, change.key) in failed_keys:
+                if change.operation is ChangeOperation.CREATE:
+                    # The ID may have been taken by an event the store doesn't know about.
+                    statements.append(("UPDATE calendars SET seeded=0 WHERE service=? AND calendar_id=?",
+                                       (self.service_name, self.calendar_id)))
+            elif change.operation is ChangeOperation.DELETE:
+                released_ids.append(change.key)
+            else:
+                synced_events[change.key] = change.synced_event
+        statements.extend(self._get_record_synced_statements(synced_events))
+        statements.extend(self._get_release_statements(released_ids))
+        self.store.execute_many(statements)
+
+    def _get_record_synced_statements(self, synced_events: Mapping[str, Tuple[str, str]]) -> List[Tuple[str, tuple]]:
+        synced_time = time.time()
+        statements = []
+        for remote_id, (addon_event_id, content_hash) in synced_events.items():
+            # An addon event ID maps to a single remote event, release any it was previously synced to.
+            statements.append(("UPDATE events SET addon_event_id=NULL, content_hash=NULL "
+                               "WHERE service=? AND calendar_id=? AND addon_event_id=? AND remote_id!=?",
+                               (self.service_name, self.calendar_id, addon_event_id, remote_id)))
+            statements.append(("INSERT INTO events (service, calendar_id, remote_id, addon_event_id, content_hash, last_synced) "
+                               "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (service, calendar_id, remote_id) DO UPDATE SET "
+                               "addon_event_id=excluded.addon_event_id, content_hash=excluded.content_hash, "
+                               "last_synced=excluded.last_synced",
+                               (self.service_name, self.calendar_id, remote_id, addon_event_id, content_hash, synced_time)))
+        return statements
+
+    def _get_release_statements(self, remote_ids: Iterable[str]) -> List[Tuple[str, tuple]]:
+        return [("UPDATE events SET addon_event_id=NULL, content_hash=NULL WHERE service=? AND calendar_id=? AND remote_id=?",
+                 (self.service_name, self.calendar_id, remote_id)) for remote_id in remote_ids]
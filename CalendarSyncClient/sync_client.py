@@ -1,38 +1,84 @@
+import argparse
 import configparser
-import importlib
+import contextlib
+import cProfile
+import glob
+import hashlib
+import json
 import logging
 import os
 import threading
-import time
+import traceback
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from pathlib import Path
 from sys import exit
-from typing import List
+from typing import Dict, List, Set, Tuple
 
 import pytz
-from slpp import slpp as lua
 from watchdog.events import PatternMatchingEventHandler
 from watchdog.observers import Observer
 
-from service_connectors import ServiceConnector, AddonEvent
+from addon_data import AddonData, read_addon_data
+from instrumentation import InlineExecutor, SyncMetrics, append_metrics_record, get_counter_deltas
+from reconciliation import CalendarSyncPlan, reconcile_events, reconcile_journaled_events, reconcile_new_calendar
+from state_store import CalendarState, PendingChange, StateStore
+from sync_scheduler import SyncScheduler
+from service_connectors import ServiceConnector, AddonEvent, CalendarID, CalendarNotFoundError, ChangeOperation, FailedChange, \
+    LazyServiceConnector, write_file_atomically
 
 VERSION = "1.0.0"
 
 logging.basicConfig(format="%(name)s:%(levelname)s: %(message)s", level=logging.WARNING)
 CONFIG_PATH = "options.ini"
+DEFAULT_MAX_CONCURRENT_SYNCS = 4
+
+
+class SyncLog(object):
+    """Collects the output of a sync running on a worker thread so it can be written out in one block."""
+
+    def __init__(self, logger: logging.Logger):
+        self.logger = logger
+        self.entries = []
+
+    def print(self, message: str):
+        self.entries.append((None, message))
+
+    def error(self, message: str):
+        self.entries.append((logging.ERROR, message))
+
+    def exception(self, message: str):
+        self.entries.append((logging.ERROR, "{0}\n{1}".format(message, traceback.format_exc())))
+
+    def flush(self):
+        for level, message in self.entries:
+            if level is None:
+                print(message)
+            else:
+                self.logger.log(level, message)
+        self.entries = []
 
 
 class SyncClient(object):
 
-    def __init__(self):
+    def __init__(self, dry_run: bool = False, config_path: str = CONFIG_PATH, profile_path: str = None):
         self.logger = logging.getLogger(type(self).__name__)
+        # Plan and print changes without applying them or updating the sync state.
+        self.dry_run = dry_run
+        # Path to write a cProfile capture of the next sync to.
+        self.profile_path = profile_path
         self.sync_delay = 5
-        self.active_sync_timer = None
-        self.sync_in_progress = False
 
         self.data_path = os.path.join("data", "core")
+        self.state_store = StateStore(os.path.join(self.data_path, "state.db"))
+        # Connectors are only imported and created once a sync needs to make requests to them.
         self.service_connectors: List[ServiceConnector] = []
+        # Connectors that aren't thread safe are locked for the duration of each calendar sync.
+        # Created once a connector is first used, as whether it's thread safe isn't known until it's loaded.
+        self.service_connector_locks = {}
         self.config = configparser.ConfigParser()
-        self.config.read(CONFIG_PATH)
+        self.config.read(config_path)
         try:
             enabled_services = self.config["Services"]["EnabledServices"]
             enabled_services = enabled_services.strip().split(",")
@@ -41,158 +87,491 @@ class SyncClient(object):
 
             for service in enabled_services:
                 self._load_service_connector(service)
+            # Changing the enabled services or their options has to resync files and calendars that haven't changed.
+            self.service_config_fingerprint = self._get_service_config_fingerprint(enabled_services)
+
+            self.max_concurrent_syncs = max(1, self.config.getint("Services", "MaxConcurrentSyncs",
+                                                                  fallback=DEFAULT_MAX_CONCURRENT_SYNCS))
+            # Optional JSON lines file to append the metrics for each sync to.
+            self.metrics_file_path = self.config.get("Metrics", "JsonLinesFile", fallback=None)
 
         except (KeyError, configparser.NoSectionError, configparser.NoOptionError) as e:
             self.logger.error("No services enabled. Please set desired services in options.ini. See example_options for help.")
             input()
             exit()
 
+        # Each addon data file is synced on its own, with calendar and service pairs from every file sharing one pool.
+        self.sync_scheduler = SyncScheduler(self._sync_calendar, self.sync_delay, self.max_concurrent_syncs)
+        self.service_sync_executor = ThreadPoolExecutor(max_workers=self.max_concurrent_syncs)
+        self.sync_state_lock = threading.Lock()
+        # Addon data file path: names of the calendars in the file when it was last parsed, loaded from the sync state
+        # on the first sync. Used to sync each calendar only from the most recently saved file holding it.
+        self.file_calendars = None
+        # Locks held while a calendar is synced, so files reporting the same calendar sync it one at a time.
+        self.calendar_locks = defaultdict(threading.Lock)
+        # Locks held while the outbox for a (service name, calendar ID) is applied, so changes in flight aren't resumed.
+        self.outbox_locks = defaultdict(threading.Lock)
+        self.locks_lock = threading.Lock()
+
     def _load_service_connector(self, connector_name):
-        module = importlib.import_module("."+connector_name, ".service_connectors")
-        config = self.config[connector_name]
-        connector = getattr(module, "get_connector")(config)
-        self.service_connectors.append(connector)
+        self.service_connectors.append(LazyServiceConnector(connector_name, self.config[connector_name]))
+
+    def _get_service_connector_lock(self, service: ServiceConnector):
+        """Return the lock to hold while syncing a calendar to the service, loading the service if it isn't loaded."""
+        # Loaded before taking locks_lock, so importing the connector doesn't hold up other syncs.
+        thread_safe = service.thread_safe
+        with self.locks_lock:
+            if service not in self.service_connector_locks:
+                self.service_connector_locks[service] = contextlib.nullcontext() if thread_safe else threading.Lock()
+            return self.service_connector_locks[service]
 
     @property
-    def _addon_data_path(self):
+    def _addon_data_paths(self) -> List[str]:
+        """Return the addon data files to sync. SaveFilePath holds a path or glob pattern per line."""
         try:
-            addon_data_file_path = self.config["AddOn"]["SaveFilePath"]
-            if not addon_data_file_path:
+            save_file_patterns = [line.strip() for line in self.config["AddOn"]["SaveFilePath"].splitlines() if line.strip()]
+            if not save_file_patterns:
                 raise configparser.NoOptionError("Addon", "SaveFilePath")
-            if not os.path.exists(addon_data_file_path):
-                self.logger.error("""Addon save file not found: {0}.
-                      Ensure options.ini is correct and you've run the AddOn at least once.""".format(addon_data_file_path))
-                input()
-                exit()
-            return addon_data_file_path
+            addon_data_file_paths = []
+            for save_file_pattern in save_file_patterns:
+                matching_paths = sorted(glob.glob(save_file_pattern, recursive=True))
+                if not matching_paths:
+                    self.logger.error("""Addon save file not found: {0}.
+                          Ensure options.ini is correct and you've run the AddOn at least once.""".format(save_file_pattern))
+                    input()
+                    exit()
+                addon_data_file_paths.extend(path for path in matching_paths if path not in addon_data_file_paths)
+            return addon_data_file_paths
         except (KeyError, configparser.NoSectionError, configparser.NoOptionError) as e:
             self.logger.error("Missing addon path in options.ini. See example_options for help.")
             input()
             exit()
 
     def run_auto_update(self):
-        """Watch the addon data file for changes, scheduling a sync when changes are detected."""
-        addon_data_file_path = self._addon_data_path
-
-        addon_data_file_name = os.path.basename(addon_data_file_path)
-        addon_data_dir_path = os.path.dirname(addon_data_file_path)
+        """Watch the addon data files for changes, scheduling a sync of a file when changes to it are detected."""
+        observer = Observer()
+        for addon_data_file_path in self._addon_data_paths:
+            addon_data_file_name = os.path.basename(addon_data_file_path)
+            addon_data_dir_path = os.path.dirname(addon_data_file_path)
 
-        event_handler = PatternMatchingEventHandler(patterns=["*"+addon_data_file_name], ignore_directories=True)
-        event_handler.on_modified = lambda event: self.schedule_sync()
+            event_handler = PatternMatchingEventHandler(patterns=["*"+addon_data_file_name], ignore_directories=True)
+            event_handler.on_modified = lambda event, path=addon_data_file_path: self.schedule_sync(path)
+            observer.schedule(event_handler, addon_data_dir_path, recursive=False)
+            print("Watching {0} for changes.".format(addon_data_file_path))
 
-        observer = Observer()
-        observer.schedule(event_handler, addon_data_dir_path, recursive=False)
         observer.start()
-        print("Watching {0} for changes.".format(addon_data_file_path))
+        self.sync_scheduler.start()
         try:
-            while True:
-                time.sleep(1)
+            # Joined in short waits so Ctrl+C stops the client on Windows.
+            while not self.sync_scheduler.join(1):
+                pass
         except KeyboardInterrupt:
+            pass
+        finally:
             observer.stop()
+            self.sync_scheduler.stop()
         observer.join()
 
-    def schedule_sync(self):
-        """Schedule a sync to run after the config sync_delay and any running syncs have completed."""
-        if self.active_sync_timer:
-            self.active_sync_timer.cancel()
-            self.active_sync_timer = None
-
-        if self.sync_in_progress:
-            self.active_sync_timer = threading.Timer(self.sync_delay, self.schedule_sync)
-        else:
-            self.active_sync_timer = threading.Timer(self.sync_delay, self._sync_calendar)
-        self.active_sync_timer.start()
-
-    def _sync_calendar(self):
-        print("Syncing calendar...")
-        self.sync_in_progress = True
-        addon_data_file_path = self._addon_data_path
-
-        with open(addon_data_file_path, "r", encoding="utf-8") as data_file:
-            combined_lines = str.join("", data_file.readlines())
-            # Ensure data is contained in an object.
-            if combined_lines[0] != "{":
-                combined_lines = "{" + combined_lines + "}"
-            addon_data = lua.decode(combined_lines.replace("\\n", "\n"))
-
-        lookahead_days = int(addon_data["CalendarSyncDB"]["profiles"]["Default"]["lookaheadDays"])
-        addon_calendars = addon_data["CalendarSyncDB"]["profiles"]["Default"]["calendars"]
-        for calendar_name, addon_calendar_data in addon_calendars.items():
-            print("Found in-game calendar: {0}".format(calendar_name))
-            addon_events = addon_calendar_data["events"]  # type: List[AddonEvent]
+    def schedule_sync(self, addon_data_file_path: str = None):
+        """Schedule a sync of an addon data file, or every file if None, to run after no changes have been detected
+        to it for the config sync_delay. Changes detected while a sync is running schedule a single follow-up sync."""
+        addon_data_file_paths = [addon_data_file_path] if addon_data_file_path else self._addon_data_paths
+        for path in addon_data_file_paths:
+            self.sync_scheduler.request_sync(path)
+
+    def _sync_calendar(self, addon_data_file_path: str):
+        print("Syncing {0}...".format(addon_data_file_path))
+        metrics = SyncMetrics()
+        # Requests from syncs of other files running at the same time are included in these.
+        request_stats = {service: service.get_request_stats() for service in self.service_connectors}
+        transport_stats = {service: service.get_transport_stats() for service in self.service_connectors}
+        profile_path, self.profile_path = self.profile_path, None
+        profiler = None
+        if profile_path:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            self._sync_addon_calendars(addon_data_file_path, metrics, profiling=profiler is not None)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(profile_path)
+                print("Profile of sync written to {0}".format(profile_path))
 
             for service in self.service_connectors:
-                print("Updating service: {0}".format(service.service_name))
-                cal_id = service.get_calender_id_by_name(calendar_name)
-                if not cal_id:
-                    print("{0} not found, creating it.".format(calendar_name))
-                    cal_id = service.create_calendar(calendar_name)
-
-                # Note: We're controlling the sync here to ease service complexity, but it may need to change to
-                # a generic service.sync() depending on whether future services can fit in this pattern.
-
-                remote_events = service.get_events(cal_id, lookahead_days)
-                # New/updated events.
-                for addon_event in addon_events:
-                    # Ensure we're using IDs as strings for sub-id support.
-                    addon_event["eventID"] = str(addon_event["eventID"])
-                    event_exists = False
-                    for remote_event in remote_events:
-                        event_comparison = service.compare_events(addon_event, remote_event)
-                        if event_comparison is event_comparison.UPDATED:
-                            event_exists = True
-                            print("\nUpdating event: {0}.".format(service.event_tostring(remote_event)))
-                            service.update_event(cal_id, remote_event, addon_event)
-                            break
-
-                        elif event_comparison is event_comparison.EQUAL:
-                            event_exists = True
-                            break
-
-                    if not event_exists:
-                        # Hacky check to catch WoW reusing old event IDs and to support external events to be created without ID conflicts.
-                        # TODO [Duplicate IDs]: Think of a cleaner way to support this behaviour in the sync.
-                        existing_event = service.get_event(cal_id, addon_event)
-                        if existing_event is not None:
-                            print("EventID for {0} - {1} @ {2} has been reused, manually forcing a new ID.".format(
-                                addon_event["eventID"],
-                                addon_event["title"],
-                                datetime.fromtimestamp(addon_event["startTime"]).isoformat()))
-                            addon_event["eventID"] = service.create_subid(addon_event, existing_event)
-                            addon_events.append(addon_event)
-                            continue
-
-                        start_datetime = datetime.fromtimestamp(addon_event["startTime"], tz=pytz.utc)
-                        end_datetime = datetime.fromtimestamp(addon_event["endTime"], tz=pytz.utc)
-                        description = addon_event["description"] if "description" in addon_event else "null"
-
-                        print("\nCreating new event:")
-                        print("\t {0} - {1}".format(start_datetime.isoformat(), end_datetime.isoformat()))
-                        print("\t" + addon_event["title"])
-                        print("\t- " + addon_event["creator"])
-                        print("\t" + description)
-                        print("\t--")
-
-                        service.create_event(cal_id, addon_event)
-
-                # Removed events.
-                for remote_event in remote_events:
-                    event_exists = False
-                    for addon_event in addon_events:
-                        event_comparison = service.compare_events(addon_event, remote_event)
-                        if event_comparison is not event_comparison.DIFFERENT:
-                            event_exists = True
-                            break
+                counters = dict(get_counter_deltas(request_stats[service], service.get_request_stats()))
+                counters.update(get_counter_deltas(transport_stats[service], service.get_transport_stats()))
+                for name, value in counters.items():
+                    metrics.increment("{0} {1}".format(service.service_name, name), value)
+            metrics.finish()
+            print(metrics.get_summary())
+            if self.metrics_file_path:
+                append_metrics_record(self.metrics_file_path, metrics, file=addon_data_file_path)
+
+    def _sync_addon_calendars(self, addon_data_file_path: str, metrics: SyncMetrics, profiling: bool = False):
+        if not self.dry_run:
+            with metrics.time_phase("resume"):
+                self._resume_pending_changes()
+        with self.sync_state_lock:
+            sync_state = self._load_sync_state()
+            if self.file_calendars is None:
+                addon_data_file_paths = self._addon_data_paths
+                self.file_calendars = {path: calendar_names for path, calendar_names in sync_state.get("file_calendars", {}).items()
+                                       if path in addon_data_file_paths}
+
+        # Dry runs always plan every calendar to show the full set of changes.
+        # WoW rewrites the file on every logout and reload, so skip the parse when the file hasn't been touched at all.
+        file_stat = os.stat(addon_data_file_path)
+        file_signature = [file_stat.st_size, file_stat.st_mtime_ns, self.service_config_fingerprint]
+        if sync_state.get("file_signatures", {}).get(addon_data_file_path) == file_signature and not self.dry_run:
+            print("No changes to {0} since last sync.".format(addon_data_file_path))
+            return
+
+        with metrics.time_phase("parse"):
+            addon_data = read_addon_data(addon_data_file_path)
+        metrics.increment("bytes read", file_stat.st_size)
+        lookahead_days = addon_data.lookahead_days
+        addon_calendars = addon_data.calendars
+        with self.sync_state_lock:
+            self.file_calendars[addon_data_file_path] = sorted(addon_calendars)
+        calendar_fingerprints = sync_state.get("calendar_fingerprints", {})
+        journal_cursors = sync_state.get("journal_cursors", {})
+        synced_fingerprints = {}
+        synced_journal_cursors = {}
+        sync_succeeded = True
+        # cProfile only sees the thread it's enabled on, so services are synced on this thread while profiling.
+        executor = InlineExecutor() if profiling else self.service_sync_executor
+        # Locks are taken in name order so files sharing calendars can't deadlock.
+        with self.locks_lock:
+            calendar_locks = [self.calendar_locks[calendar_name] for calendar_name in sorted(addon_calendars)]
+        with contextlib.ExitStack() as held_locks:
+            for calendar_lock in calendar_locks:
+                held_locks.enter_context(calendar_lock)
+
+            # Another account's file may hold a newer copy of the same guild calendar, which its own sync will use.
+            # All files are synced at once on startup, so this can't rely on which file happened to sync first.
+            newer_sources = self._get_newer_calendar_sources(addon_data_file_path, file_stat.st_mtime_ns)
+            calendar_syncs = []
+            for calendar_name, addon_events in addon_calendars.items():
+                print("Found in-game calendar: {0}".format(calendar_name))
+
+                if calendar_name in newer_sources:
+                    print("Skipping {0}, {1} has a newer copy.".format(calendar_name, newer_sources[calendar_name]))
+                    continue
+
+                journal_cursor = self._get_journal_cursor(addon_data_file_path, addon_data, calendar_name)
+                fingerprint = self._get_calendar_fingerprint(addon_events, lookahead_days)
+                if calendar_fingerprints.get(calendar_name) == fingerprint and not self.dry_run:
+                    print("No changes to {0} since last sync.".format(calendar_name))
+                    synced_journal_cursors[calendar_name] = journal_cursor
+                    continue
+
+                changed_event_ids = self._get_journaled_event_ids(addon_data, calendar_name,
+                                                                  journal_cursors.get(calendar_name), journal_cursor)
+                if changed_event_ids is not None:
+                    print("{0} events journaled as changed since last sync.".format(len(changed_event_ids)))
+                    metrics.increment("journaled events", len(changed_event_ids))
+
+                # Each service gets its own copy of the events as syncing may assign them sub-IDs.
+                service_syncs = [executor.submit(self._sync_service_calendar, service, calendar_name,
+                                                 [dict(addon_event) for addon_event in addon_events], lookahead_days, metrics,
+                                                 changed_event_ids)
+                                 for service in self.service_connectors]
+                calendar_syncs.append((calendar_name, fingerprint, journal_cursor, service_syncs))
+
+            # Output is written in submission order so logs for each calendar and service are kept together.
+            for calendar_name, fingerprint, journal_cursor, service_syncs in calendar_syncs:
+                calendar_succeeded = True
+                for service_sync in service_syncs:
+                    service_succeeded, sync_log = service_sync.result()
+                    sync_log.flush()
+                    calendar_succeeded &= service_succeeded
+
+                synced_fingerprints[calendar_name] = fingerprint if calendar_succeeded else None
+                synced_journal_cursors[calendar_name] = journal_cursor if calendar_succeeded else None
+                sync_succeeded &= calendar_succeeded
+
+        if not self.dry_run:
+            with metrics.time_phase("save state"), self.sync_state_lock:
+                # Other files may have been synced since the state was loaded.
+                sync_state = self._load_sync_state()
+                calendar_fingerprints = sync_state.setdefault("calendar_fingerprints", {})
+                for calendar_name, fingerprint in synced_fingerprints.items():
+                    if fingerprint is not None:
+                        calendar_fingerprints[calendar_name] = fingerprint
+                    else:
+                        calendar_fingerprints.pop(calendar_name, None)
+                journal_cursors = sync_state.setdefault("journal_cursors", {})
+                for calendar_name, journal_cursor in synced_journal_cursors.items():
+                    if journal_cursor is not None:
+                        journal_cursors[calendar_name] = journal_cursor
+                    else:
+                        journal_cursors.pop(calendar_name, None)
+                # Only skip future parses once everything in this version of the file has been synced.
+                sync_state.setdefault("file_signatures", {})[addon_data_file_path] = file_signature if sync_succeeded else None
+                sync_state["file_calendars"] = dict(self.file_calendars)
+                self._save_sync_state(sync_state)
+        print("Sync complete")
 
-                    if not event_exists:
-                        print("\n{0}\n\tNo longer exists, removing".format(service.event_tostring(remote_event)))
-                        service.remove_event(cal_id, remote_event)
+    def _sync_service_calendar(self, service: ServiceConnector, calendar_name: str, addon_events: List[AddonEvent],
+                               lookahead_days: int, metrics: SyncMetrics,
+                               changed_event_ids: Set[str] = None) -> Tuple[bool, SyncLog]:
+        """Sync the addon events for a calendar to a service, only reconciling changed_event_ids if given.
+        Return whether every change was applied, along with the output of the sync."""
+        sync_log = SyncLog(self.logger)
+        try:
+            # Getting the lock loads the service, which may fail now rather than on startup.
+            with self._get_service_connector_lock(service):
+                return self._sync_service_calendar_events(service, calendar_name, addon_events, lookahead_days,
+                                                          sync_log, metrics, changed_event_ids), sync_log
+        except Exception:
+            sync_log.exception("Failed to sync {0} to {1}.".format(calendar_name, service.service_name))
+            return False, sync_log
+
+    def _sync_service_calendar_events(self, service: ServiceConnector, calendar_name: str, addon_events: List[AddonEvent],
+                                      lookahead_days: int, sync_log: SyncLog, metrics: SyncMetrics,
+                                      changed_event_ids: Set[str] = None) -> bool:
+        sync_log.print("Updating service: {0} ({1})".format(service.service_name, calendar_name))
+        # Note: We're controlling the sync here to ease service complexity, but it may need to change to
+        # a generic service.sync() depending on whether future services can fit in this pattern.
+        try:
+            plan = self._plan_service_calendar(service, calendar_name, addon_events, lookahead_days, metrics,
+                                               changed_event_ids)
+        except CalendarNotFoundError:
+            # The service may have cached an ID for a calendar that has since been deleted, so look it up again.
+            sync_log.print("{0} no longer exists, finding it again.".format(calendar_name))
+            plan = self._plan_service_calendar(service, calendar_name, addon_events, lookahead_days, metrics,
+                                               changed_event_ids)
+
+        self._print_plan(service, plan, sync_log)
+        for change in plan.changes:
+            metrics.increment("{0}s".format(change.operation.name.lower()))
+        if self.dry_run:
+            return True
+        with metrics.time_phase("apply"):
+            return self._apply_plan(service, plan, sync_log, metrics)
+
+    def _plan_service_calendar(self, service: ServiceConnector, calendar_name: str, addon_events: List[AddonEvent],
+                               lookahead_days: int, metrics: SyncMetrics,
+                               changed_event_ids: Set[str] = None) -> CalendarSyncPlan:
+        """Work out the changes needed to sync the addon events to a service, without changing anything on it.
+        If changed_event_ids is given and the calendar has been synced before, only those events are reconciled."""
+        with metrics.time_phase("lookup"):
+            cal_id = service.get_calender_id_by_name(calendar_name)
+        with metrics.time_phase("reconcile"):
+            if not cal_id:
+                changes = reconcile_new_calendar(service, addon_events)
+            else:
+                state = self.state_store.get_calendar_state(service.service_name, cal_id)
+                remote_events = metrics.time_iterator("list", service.get_events(cal_id, lookahead_days))
+                if changed_event_ids is not None and state.is_seeded():
+                    changes = reconcile_journaled_events(service, cal_id, addon_events, remote_events, state,
+                                                         changed_event_ids)
+                else:
+                    changes = reconcile_events(service, cal_id, addon_events, remote_events, state)
+        return CalendarSyncPlan(calendar_name, cal_id, changes, changes.get_changes(service))
+
+    def _print_plan(self, service: ServiceConnector, plan: CalendarSyncPlan, sync_log: SyncLog):
+        if plan.calendar_id is None:
+            sync_log.print("{0} not found, creating it.".format(plan.calendar_name))
+
+        for original_id, addon_event in plan.reconciliation.reassigned_ids:
+            sync_log.print("EventID for {0} - {1} @ {2} has been reused, manually forcing a new ID.".format(
+                original_id,
+                addon_event["title"],
+                datetime.fromtimestamp(addon_event["startTime"]).isoformat()))
+
+        for change in plan.changes:
+            if change.operation is ChangeOperation.UPDATE:
+                sync_log.print("\nUpdating event: {0} ({1}).".format(service.event_tostring(change.event[0]),
+                                                                     ", ".join(sorted(change.changed_fields))))
+
+        for change in plan.changes:
+            if change.operation is ChangeOperation.CREATE:
+                addon_event = change.event
+                start_datetime = datetime.fromtimestamp(addon_event["startTime"], tz=pytz.utc)
+                end_datetime = datetime.fromtimestamp(addon_event["endTime"], tz=pytz.utc)
+                description = addon_event["description"] if "description" in addon_event else "null"
+
+                sync_log.print("\nCreating new event:")
+                sync_log.print("\t {0} - {1}".format(start_datetime.isoformat(), end_datetime.isoformat()))
+                sync_log.print("\t" + addon_event["title"])
+                sync_log.print("\t- " + addon_event["creator"])
+                sync_log.print("\t" + description)
+                sync_log.print("\t--")
+
+        for change in plan.changes:
+            if change.operation is ChangeOperation.DELETE:
+                sync_log.print("\n{0}\n\tNo longer exists, removing".format(service.event_tostring(change.event)))
+
+        if self.dry_run:
+            request_count = service.get_request_count(len(plan.changes)) + (1 if plan.calendar_id is None else 0)
+            sync_log.print("\nDry run: {0} creates, {1} updates and {2} deletes planned for {3}, "
+                           "estimated {4} requests to {5}.".format(
+                               len(plan.reconciliation.creates), len(plan.reconciliation.updates),
+                               len(plan.reconciliation.deletes), plan.calendar_name, request_count, service.service_name))
+
+    def _apply_plan(self, service: ServiceConnector, plan: CalendarSyncPlan, sync_log: SyncLog, metrics: SyncMetrics) -> bool:
+        """Apply the changes in a plan, returning whether every change was applied."""
+        cal_id = plan.calendar_id
+        if cal_id is None:
+            cal_id = service.create_calendar(plan.calendar_name)
+        state = self.state_store.get_calendar_state(service.service_name, cal_id)
+        # Seeded here rather than while planning, so dry runs leave the state store untouched.
+        if plan.reconciliation.seed_keys is not None:
+            state.seed(plan.reconciliation.seed_keys)
+
+        unchanged_keys = [service.get_remote_event_key(remote_event) for remote_event, _ in plan.reconciliation.unchanged]
+        state.record_synced({key: plan.reconciliation.synced_events[key] for key in unchanged_keys})
+
+        # Changes are written to the outbox first, so a sync interrupted part way through can be resumed.
+        with self._get_outbox_lock(service, cal_id):
+            failed_changes = self._apply_pending_changes(service, state, cal_id, state.add_pending_changes(plan.changes))
+        metrics.increment("failed changes", len(failed_changes))
+        for failed_change in failed_changes:
+            sync_log.error("Failed to {0} event {1}: {2}".format(
+                failed_change.operation.name.lower(), failed_change.event, failed_change.error))
+
+        return not failed_changes
+
+    def _resume_pending_changes(self):
+        """Apply changes left in the outbox by a sync that was interrupted before they were confirmed."""
+        for service in self.service_connectors:
+            for state in self.state_store.get_pending_calendar_states(service.service_name):
+                try:
+                    # Locks are taken in the same order as syncs applying a plan, connector then outbox, so they can't deadlock.
+                    with self._get_service_connector_lock(service):
+                        outbox_lock = self._get_outbox_lock(service, state.calendar_id)
+                        # Changes for a calendar that's being applied by another sync are still in flight.
+                        if not outbox_lock.acquire(blocking=False):
+                            continue
+                        try:
+                            pending_changes = state.get_pending_changes()
+                            if not pending_changes:
+                                continue
+                            print("Resuming {0} changes to {1} from an interrupted sync.".format(len(pending_changes), service.service_name))
+                            failed_changes = self._apply_pending_changes(service, state, state.calendar_id, pending_changes)
+                        finally:
+                            outbox_lock.release()
+                except Exception:
+                    self.logger.exception("Failed to resume changes to {0}.".format(service.service_name))
+                    continue
+                # Failed changes are dropped from the outbox, reconciling the calendar will redo them if still needed.
+                for failed_change in failed_changes:
+                    self.logger.error("Failed to {0} event {1}: {2}".format(
+                        failed_change.operation.name.lower(), failed_change.event, failed_change.error))
+
+    def _get_outbox_lock(self, service: ServiceConnector, cal_id: CalendarID) -> threading.Lock:
+        with self.locks_lock:
+            return self.outbox_locks[(service.service_name, str(cal_id))]
+
+    def _apply_pending_changes(self, service: ServiceConnector, state: CalendarState, cal_id: CalendarID,
+                               pending_changes: List[PendingChange]) -> List[FailedChange]:
+        """Apply changes from the outbox, then record the ones that were applied and clear them from the outbox.
+        Changes are safe to apply again as events are created with fixed IDs and updates overwrite the same fields.
+        """
+        failed_changes = service.apply_changes(
+            cal_id,
+            [change.event for change in pending_changes if change.operation is ChangeOperation.CREATE],
+            [change.event for change in pending_changes if change.operation is ChangeOperation.UPDATE],
+            [change.event for change in pending_changes if change.operation is ChangeOperation.DELETE])
+        failed_changes = [failed_change for failed_change in failed_changes
+                          if not service.is_change_already_applied(failed_change.operation, failed_change.error)]
+
+        failed_keys = set()
+        for failed_change in failed_changes:
+            if failed_change.operation is ChangeOperation.CREATE:
+                failed_keys.add((failed_change.operation, service.get_addon_event_key(failed_change.event)))
+            elif failed_change.operation is ChangeOperation.UPDATE:
+                failed_keys.add((failed_change.operation, service.get_remote_event_key(failed_change.event[0])))
+            else:
+                failed_keys.add((failed_change.operation, service.get_remote_event_key(failed_change.event)))
+        state.complete_pending_changes(pending_changes, failed_keys)
+        return failed_changes
+
+    def _get_newer_calendar_sources(self, addon_data_file_path: str, file_mtime_ns: int) -> Dict[str, str]:
+        """Return calendar name: path for the calendars that another watched file saved more recently also holds."""
+        with self.sync_state_lock:
+            file_calendars = dict(self.file_calendars)
+        newer_sources = {}
+        for path, calendar_names in file_calendars.items():
+            if path == addon_data_file_path:
+                continue
+            try:
+                if os.stat(path).st_mtime_ns <= file_mtime_ns:
+                    continue
+            except OSError:
+                continue
+            for calendar_name in calendar_names:
+                newer_sources.setdefault(calendar_name, path)
+        return newer_sources
+
+    def _get_calendar_fingerprint(self, addon_events: List[AddonEvent], lookahead_days: int) -> str:
+        """Return a hash of the addon events for a calendar along with everything else that affects how it's synced."""
+        fingerprint_data = {
+            "service_config": self.service_config_fingerprint,
+            "lookahead_days": lookahead_days,
+            "events": sorted(addon_events, key=lambda event: str(event["eventID"])),
+        }
+        return hashlib.sha256(json.dumps(fingerprint_data, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _get_service_config_fingerprint(self, enabled_services: List[str]) -> str:
+        """Return a hash of the enabled services and their options."""
+        service_config = [[service, sorted(self.config[service].items())] for service in enabled_services]
+        return hashlib.sha256(json.dumps(service_config).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _get_journal_cursor(addon_data_file_path: str, addon_data: AddonData, calendar_name: str) -> list or None:
+        """Return the position in the calendar's journal that syncing the file brings the calendar up to,
+        along with everything else that has to match for the journal to be followed from there."""
+        journal = addon_data.journals.get(calendar_name)
+        if journal is None:
+            return None
+        return [addon_data_file_path, journal.journal_id, addon_data.lookahead_days, addon_data.revision]
+
+    @staticmethod
+    def _get_journaled_event_ids(addon_data: AddonData, calendar_name: str, last_journal_cursor: list or None,
+                                 journal_cursor: list or None) -> Set[str] or None:
+        """Return the IDs of the events journaled as changed since the calendar was last synced,
+        or None if every event needs reconciling."""
+        # Cursors from another file, a reset journal or a different lookahead can't be followed.
+        if last_journal_cursor is None or journal_cursor is None or last_journal_cursor[:3] != journal_cursor[:3]:
+            return None
+        last_revision = last_journal_cursor[3]
+        if last_revision > addon_data.revision:
+            return None
+        return addon_data.journals[calendar_name].get_changed_event_ids(last_revision)
+
+    def _load_sync_state(self) -> dict:
+        sync_state_path = os.path.join(self.data_path, "sync_state.json")
+        if not os.path.exists(sync_state_path):
+            return {}
+        try:
+            with open(sync_state_path, "r", encoding="utf-8") as sync_state_file:
+                return json.load(sync_state_file)
+        except ValueError:
+            # Everything in the sync state can be rebuilt, so an unreadable file just means a full sync.
+            self.logger.warning("Ignoring unreadable {0}, syncing every calendar.".format(sync_state_path))
+            return {}
 
-        print("Sync complete")
-        self.sync_in_progress = False
+    def _save_sync_state(self, sync_state: dict):
+        Path(self.data_path).mkdir(parents=True, exist_ok=True)
+        write_file_atomically(os.path.join(self.data_path, "sync_state.json"), [json.dumps(sync_state).encode("utf-8")])
 
 
 if __name__ == "__main__":
-    sync_client = SyncClient()
-    sync_client.schedule_sync()
-    sync_client.run_auto_update()
+    parser = argparse.ArgumentParser(description="Sync the CalendarSync AddOn's calendars to the enabled services.")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Print the changes the next sync would make and their estimated cost, without applying them.")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="Write a cProfile capture of the first sync to FILE. Services are synced one at a time while "
+                             "profiling so every call is captured.")
+    args = parser.parse_args()
+
+    sync_client = SyncClient(dry_run=args.dry_run, profile_path=args.profile)
+    if args.dry_run:
+        for addon_data_file_path in sync_client._addon_data_paths:
+            sync_client._sync_calendar(addon_data_file_path)
+    else:
+        sync_client.schedule_sync()
+        sync_client.run_auto_update()
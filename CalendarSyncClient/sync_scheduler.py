@@ -0,0 +1,87 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, Set
+
+
+class SyncScheduler(object):
+    """Runs syncs for each key once sync requests for that key have stopped arriving for debounce_delay seconds.
+
+    Requests are coalesced per key: any number of requests within the debounce window results in a single sync, and
+    requests made while a sync is running queue at most one follow-up sync. Syncs for the same key never overlap,
+    while syncs for different keys run at the same time on a pool of up to max_workers threads.
+    """
+
+    def __init__(self, sync_function: Callable[[Hashable], None], debounce_delay: float, max_workers: int = 1):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.sync_function = sync_function
+        self.debounce_delay = debounce_delay
+        self._condition = threading.Condition()
+        # Time of the most recent request not yet handled by a sync, for each key with a sync pending.
+        self._last_request_times: Dict[Hashable, float] = {}
+        self._running_keys: Set[Hashable] = set()
+        self._stopping = False
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=type(self).__name__)
+        self._thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def request_sync(self, key: Hashable = None):
+        """Schedule a sync of key for once requests for it have been quiet for the debounce delay."""
+        with self._condition:
+            self._last_request_times[key] = time.monotonic()
+            self._condition.notify()
+
+    def stop(self):
+        """Stop the scheduler, waiting for running syncs to finish. Pending syncs are discarded."""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread.is_alive() and threading.current_thread() is not self._thread:
+            self._thread.join()
+
+    def join(self, timeout: float = None) -> bool:
+        """Block until the scheduler has been stopped or timeout seconds have passed, returning whether it stopped.
+        On Windows, Ctrl+C isn't delivered during a join without a timeout, so callers waiting on it should loop."""
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def _wait_for_due_keys(self) -> Set[Hashable]:
+        """Wait until syncs are due, returning their keys, or an empty set if the scheduler is stopping instead."""
+        with self._condition:
+            while not self._stopping:
+                now = time.monotonic()
+                # Requests for keys that are syncing wait for the running sync to finish.
+                remaining_delays = {key: last_request_time + self.debounce_delay - now
+                                    for key, last_request_time in self._last_request_times.items()
+                                    if key not in self._running_keys}
+                due_keys = {key for key, remaining_delay in remaining_delays.items() if remaining_delay <= 0}
+                if due_keys:
+                    for key in due_keys:
+                        # Requests from here on are handled by a follow-up sync.
+                        del self._last_request_times[key]
+                    self._running_keys.update(due_keys)
+                    return due_keys
+                self._condition.wait(min(remaining_delays.values()) if remaining_delays else None)
+            return set()
+
+    def _run(self):
+        while True:
+            due_keys = self._wait_for_due_keys()
+            if not due_keys:
+                break
+            for key in due_keys:
+                self._executor.submit(self._run_sync, key)
+        self._executor.shutdown(wait=True)
+
+    def _run_sync(self, key: Hashable):
+        try:
+            self.sync_function(key)
+        except Exception:
+            self.logger.exception("Sync failed.")
+        finally:
+            with self._condition:
+                self._running_keys.discard(key)
+                self._condition.notify()
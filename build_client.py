@@ -1,28 +1,51 @@
+import json
 import os
+import platform
 import re
 import shutil
+import subprocess
 import sys
-
-from cx_Freeze import setup, Executable
+import tempfile
+import time
 
 build_dir = "build/client"
 client_name = "CalendarSyncClient"
+# Startup benchmark results are appended here, one JSON object per line, to compare startup between releases.
+startup_benchmark_path = os.path.join(build_dir, "startup_times.jsonl")
+# Modules that should only be imported once a sync needs to make requests, not on startup.
+deferred_modules = ["service_connectors.google_calendar", "googleapiclient", "google_auth_oauthlib", "httplib2"]
+# Starts the client as far as it gets before watching for changes, with the Google connector enabled but not used.
+startup_script = """
+import sync_client
+sync_client.SyncClient()
+"""
+startup_options = """
+[Services]
+EnabledServices=google_calendar
 
+[google_calendar]
+CredentialsFile=credentials.json
+"""
 
-def build():
-    """Build the client to a folder and return the output path."""
-    if len(sys.argv) <= 1:
-        sys.argv.append("build")
 
+def get_version() -> str:
     with open("CalendarSyncClient/sync_client.py", 'r') as client_file:
         for line in client_file:
             stripped_line = line.replace(" ", "")
             if "VERSION=" in stripped_line:
-                version_num = re.sub("[\"'\\n]", "", stripped_line.split("=")[1])
-                break
+                return re.sub("[\"'\\n]", "", stripped_line.split("=")[1])
+
+    raise Exception("Couldn't find VERSION in sync_client.py")
+
+
+def build():
+    """Build the client to a folder and return the output path."""
+    from cx_Freeze import setup, Executable
 
-    if not version_num:
-        raise Exception("Couldn't find VERSION in sync_client.py")
+    if len(sys.argv) <= 1:
+        sys.argv.append("build")
+
+    version_num = get_version()
 
     build_path_win = os.path.join(build_dir, version_num, "win32")
     build_folder_path = os.path.join(build_path_win, client_name)
@@ -76,5 +99,79 @@ def build():
     return build_path_win
 
 
+def parse_import_times(import_time_output: str) -> list:
+    """Return (module, self us, cumulative us, depth) for each import in -X importtime output, in the order printed.
+    Imports are printed after the imports they trigger, each level of nesting indented by two spaces."""
+    imports = []
+    for line in import_time_output.splitlines():
+        fields = line.split("|")
+        if not line.startswith("import time:") or len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        module = fields[2][1:]
+        depth = (len(module) - len(module.lstrip(" "))) // 2
+        imports.append((module.strip(), int(fields[0].split(":")[1]), int(fields[1]), depth))
+    return imports
+
+
+def benchmark_startup(runs: int = 5, top_import_count: int = 10):
+    """Time starting the client from source up to watching for changes, appending the fastest of runs to
+    startup_benchmark_path. Also reports the slowest imports and any deferred_modules imported on startup."""
+    client_path = os.path.abspath(client_name)
+    environment = dict(os.environ, PYTHONPATH=client_path)
+    results = []
+    with tempfile.TemporaryDirectory() as benchmark_directory:
+        with open(os.path.join(benchmark_directory, "options.ini"), "w") as options_file:
+            options_file.write(startup_options)
+        for _ in range(runs):
+            # Each run is a fresh interpreter, so nothing is already imported.
+            start_time = time.perf_counter()
+            process = subprocess.run([sys.executable, "-X", "importtime", "-c", startup_script],
+                                     cwd=benchmark_directory, env=environment, stdin=subprocess.DEVNULL,
+                                     stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+            wall_time = time.perf_counter() - start_time
+            if process.returncode != 0:
+                raise Exception("Client failed to start:\n" + process.stderr)
+            results.append((wall_time, parse_import_times(process.stderr)))
+
+    wall_time, imports = min(results, key=lambda result: result[0])
+    import_time = sum(cumulative for _, _, cumulative, depth in imports if depth == 0)
+    # Modules imported directly by sync_client, which are printed after the previous top level import and before it.
+    client_imports = []
+    for module, _, cumulative, depth in imports:
+        if depth == 0:
+            if module == "sync_client":
+                break
+            client_imports = []
+        elif depth == 1:
+            client_imports.append((module, cumulative))
+    imported_modules = {module for module, _, _, _ in imports}
+    deferred_imports = sorted(module for module in imported_modules
+                              if any(module == deferred or module.startswith(deferred + ".") for deferred in deferred_modules))
+
+    print("Client startup: {0:.0f}ms, {1:.0f}ms importing {2} modules".format(wall_time * 1000, import_time / 1000, len(imports)))
+    print("Slowest imports:")
+    for module, cumulative in sorted(client_imports, key=lambda client_import: -client_import[1])[:top_import_count]:
+        print("    {0:>8.1f}ms {1}".format(cumulative / 1000, module))
+    if deferred_imports:
+        print("Imported on startup but should be deferred: {0}".format(", ".join(deferred_imports)))
+
+    os.makedirs(build_dir, exist_ok=True)
+    with open(startup_benchmark_path, "a") as benchmark_file:
+        benchmark_file.write(json.dumps({
+            "version": get_version(),
+            "time": int(time.time()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "wall_ms": round(wall_time * 1000, 1),
+            "import_ms": round(import_time / 1000, 1),
+            "modules": len(imports),
+            "deferred_imports": deferred_imports,
+        }) + "\n")
+    print("Results appended to {0}".format(startup_benchmark_path))
+
+
 if __name__ == "__main__":
-    build()
+    if "--startup-benchmark" in sys.argv:
+        benchmark_startup()
+    else:
+        build()